@@ -0,0 +1,216 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os import path
+
+import beancount
+from beancount import loader
+
+from modules import ledger, synthetic
+from modules.imports import pipeline
+from modules.imports.deduplicate import Deduplicate
+
+
+# 最常见的用法：导入一个微信账单，统计到识别出导入器为止的模块导入耗时
+STARTUP_SNIPPET = """
+import runpy
+runpy.run_path('import.py')
+from modules.imports import pipeline
+pipeline.identify('微信支付账单.csv', '微信支付账单明细'.encode('utf-8'))
+"""
+
+
+def measure_startup():
+    # python -X importtime 输出 "import time: self | cumulative | 模块名"，缩进表示层级
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SNIPPET],
+        cwd=path.dirname(path.abspath(__file__)), stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+            modules.append((int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return {
+        'seconds': total / 1000000,
+        'top': [{'module': name, 'seconds': cumulative / 1000000} for cumulative, name in modules[:10]],
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def generate(work_dir, postings, rows, names):
+    os.makedirs(work_dir, exist_ok=True)
+    bean = path.join(work_dir, 'main.bean')
+    synthetic.generate_ledger(bean, postings)
+    statements = []
+    for name in names:
+        filename = path.join(work_dir, name)
+        if synthetic.STATEMENTS[name](filename, rows) == False:
+            print('Skipped {}: xlwt is not installed'.format(name))
+            continue
+        statements.append(filename)
+    return bean, statements
+
+
+def bench_importer(filename, deduplicate):
+    stages = {}
+    with open(filename, 'rb') as f:
+        byte_content = f.read()
+    # 各导入器会逐条打印处理信息，计时时丢弃
+    with contextlib.redirect_stdout(io.StringIO()):
+        importer, stages['detect'] = timed(
+            pipeline.identify, filename, byte_content[:pipeline.HEAD_SIZE])
+        if importer == None:
+            raise ValueError('no suitable importer')
+        instance, seconds = timed(
+            pipeline.create_importer, importer, filename, byte_content, None)
+        if instance == None:
+            raise ValueError('{} failed to read the file'.format(importer.__name__))
+        records, stages['parse'] = timed(
+            lambda: list(instance.extract()))
+        stages['parse'] += seconds
+        entries, stages['dedup'] = timed(
+            lambda: list(importer.filter(records, deduplicate)))
+        _, stages['output'] = timed(
+            pipeline.print_entries, entries, io.StringIO())
+    return {
+        'importer': importer.__name__,
+        'records': len(records),
+        'entries': len(entries),
+        'seconds': stages,
+    }
+
+
+def run(bean, statements):
+    result = {'ledger': {}, 'importers': {}}
+    # beancount自身在加载超过1秒时也会写缓存，删掉以保证冷加载
+    pickle_cache = path.join(path.dirname(bean), loader.PICKLE_CACHE_FILENAME.format(
+        filename=path.basename(bean)))
+    if path.exists(pickle_cache):
+        os.remove(pickle_cache)
+    (entries, errors, option_map), result['ledger']['load_cold'] = timed(
+        ledger.load_file, bean, False)
+    # 先写入缓存再计时读取
+    ledger.load_file(bean)
+    _, result['ledger']['load_cached'] = timed(ledger.load_file, bean)
+    deduplicate = Deduplicate(entries, option_map)
+    # 索引在第一次查询时才建立，在这里显式建立，不计入第一个导入器的去重耗时
+    _, result['ledger']['index'] = timed(deduplicate.get_index, 'CNY')
+    result['ledger']['entries'] = len(entries)
+    result['ledger']['errors'] = len(errors)
+    for filename in statements:
+        name = path.basename(filename)
+        try:
+            result['importers'][name] = bench_importer(filename, deduplicate)
+        except Exception as e:
+            result['importers'][name] = {'error': repr(e)}
+    return result
+
+
+def best_of(runs):
+    # 多次运行时每个阶段取最短时间
+    best = runs[0]
+    for other in runs[1:]:
+        for key, seconds in other['ledger'].items():
+            if key.startswith('load') or key == 'index':
+                best['ledger'][key] = min(best['ledger'][key], seconds)
+        for name, item in other['importers'].items():
+            if 'seconds' not in item or 'seconds' not in best['importers'][name]:
+                continue
+            stages = best['importers'][name]['seconds']
+            for stage, seconds in item['seconds'].items():
+                stages[stage] = min(stages[stage], seconds)
+    return best
+
+
+def print_summary(result):
+    print('ledger: {entries} entries, load {load_cold:.3f}s (cached {load_cached:.3f}s), index {index:.3f}s'.format(
+        **result['ledger']))
+    for name, item in result['importers'].items():
+        if 'error' in item:
+            print('{}: {}'.format(name, item['error']))
+            continue
+        stages = ', '.join('{} {:.3f}s'.format(stage, seconds)
+                           for stage, seconds in item['seconds'].items())
+        print('{} ({}, {} records -> {} entries): {}'.format(
+            name, item['importer'], item['records'], item['entries'], stages))
+
+
+def main():
+    parser = argparse.ArgumentParser("benchmark")
+    parser.add_argument("--postings", type=int, default=10000,
+                        help="Postings in the synthetic ledger (default = 10000)")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="Rows per synthetic statement (default = 1000)")
+    parser.add_argument("--importer", action='append', choices=list(synthetic.STATEMENTS.keys()),
+                        help="Only benchmark these statements (repeatable)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Run several times and keep the best time of each stage")
+    parser.add_argument("--work-dir",
+                        help="Where to generate the files (default = a temporary directory)")
+    parser.add_argument("--out", help="Write JSON results to this path")
+    parser.add_argument("--startup", action='store_true',
+                        help="Only measure import.py startup with python -X importtime")
+    parser.add_argument("--startup-budget", type=float,
+                        help="Exit with 1 if startup imports take longer than this many milliseconds")
+    args = parser.parse_args()
+
+    startup = min((measure_startup() for i in range(args.repeat)),
+                  key=lambda item: item['seconds'])
+    print('startup imports: {:.0f} ms ({})'.format(
+        startup['seconds'] * 1000,
+        ', '.join('{} {:.0f} ms'.format(item['module'], item['seconds'] * 1000) for item in startup['top'][:5])))
+    over_budget = args.startup_budget != None and startup['seconds'] * 1000 > args.startup_budget
+    if over_budget:
+        print('Startup is over the budget of {:.0f} ms!'.format(args.startup_budget))
+    if args.startup:
+        exit(1 if over_budget else 0)
+
+    names = args.importer or list(synthetic.STATEMENTS.keys())
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        bean, statements = generate(work_dir, args.postings, args.rows, names)
+        # 只记录去重产生的修改，不调用apply_beans，账本在多次运行间保持不变
+        runs = [run(bean, statements) for i in range(args.repeat)]
+        result = best_of(runs)
+        os.remove(ledger.cache_path(bean))
+
+    result['startup'] = startup
+    result['meta'] = {
+        'time': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'beancount': beancount.__version__,
+        'postings': args.postings,
+        'rows': args.rows,
+        'repeat': args.repeat,
+    }
+    print_summary(result)
+    if args.out != None:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print('Outputed to ' + args.out)
+    if over_budget:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
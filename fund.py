@@ -1,22 +1,19 @@
 import argparse
+import importlib
 import json
-import os
-import re
-import tempfile
-import time
-from datetime import date
-from os import path
-from shutil import copyfile
 from string import Template
 
-import requests
-from beancount import loader
-from beancount.query import query
+from beancount.core import data
 
-currency = 'F111111'  # 该基金在Beancount里记录的货币单位
-ticker = '111111'  # 基金代码
-price = 1000  # 定投金额
-fee = 0.0013  # 手续费
+from modules import ledger
+from modules.patch import LedgerPatch
+
+# 要处理的基金，也可以用 --config 指定同样结构的JSON文件
+# currency: 该基金在Beancount里记录的货币单位；ticker: 基金代码；amounts（可选）: 只处理这些金额的买入，不填则任意金额
+# fee: 手续费；narration（可选）: 交易描述中包含该字符串时才算该基金，同一账户有多只基金时用来区分
+funds = [
+    {'currency': 'F111111', 'ticker': '111111', 'amounts': [1000], 'fee': 0.0013},
+]
 FeeAccount = 'Expenses:Finance:TradeFee'  # 手续费账户
 DeviationAccount = 'Equity:Deviation'  # 误差舍入账户
 FundAccount = 'Assets:Company:Alipay:Fund'  # 基金账户
@@ -26,84 +23,109 @@ transactionTemplate = Template(
   $deviationAccount
   $otherAccount -$originalPrice CNY''')
 
-cache_file = path.join(tempfile.gettempdir() + '/fund-temp.json')
-fund_data = {}
-if path.exists(cache_file):
-    content = open(cache_file, 'r').read()
-    fund_data = json.loads(content)
-else:
-    content = requests.get(
-        "http://fund.10jqka.com.cn/{}/json/jsondwjz.json".format(ticker)).content
-    content = content.split(b"=")[1]
-    f = open(cache_file, 'wb')
-    f.write(content)
-    f.close()
-    fund_data = json.loads(str(content))
+# 净值来自同花顺价格源，按基金代码缓存，过期后自动刷新
+jqka = importlib.import_module('modules.price_sources.10jqka')
 
 
 class Fund:
 
-    def __init__(self, entries, option_map):
+    def __init__(self, entries, option_map, funds):
         self.entries = entries
         self.option_map = option_map
-        self.beans = {}
-
-    def find_funds(self, price):
-        bql = "SELECT flag, filename, lineno, location, account, other_accounts, year, month, day, number, currency where account = \"{}\" and currency = \"CNY\" and number = {}".format(
-            FundAccount, price)
-        items = query.run_query(self.entries, self.option_map, bql)
-        # length = len(items[1])
-        feePrice = round(price * fee, 2)
-
-        for item in items[1]:
-            current_date = date(item.year, item.month, item.day)
-            date_string = current_date.strftime("%Y%m%d")
-            print('Updating ' + date_string)
-            for fund_item in fund_data:
-                if fund_item[0] == date_string:
-                    fund_price = float(fund_item[1])
-                    count = (price - feePrice) / fund_price
-                    self.update_line_to_new_line(item.location, transactionTemplate.substitute(
-                        fundAccount=FundAccount,
-                        fundCount=round(count, 2),
-                        fundCurrency=currency,
-                        costPrice=round(fund_price, 5),
-                        feeAccount=FeeAccount,
-                        fee=feePrice,
-                        deviationAccount=DeviationAccount,
-                        otherAccount=item.other_accounts[0],
-                        originalPrice=price
-                    ), 1)
-
-    def read_bean(self, filename):
-        if filename in self.beans:
-            return self.beans[filename]
-        with open(filename, 'r') as f:
-            text = f.read()
-            self.beans[filename] = text.split('\n')
-        return self.beans[filename]
-
-    def update_line_to_new_line(self, location, new_line, expand_index=0):
-        file_items = location.split(':')
-        lineno = int(file_items[1])
-        lines = self.read_bean(file_items[0])
-        lines[lineno - 1] = new_line
+        self.funds = funds
+        self.patch = LedgerPatch()
+        # ticker -> {'YYYYMMDD': 净值}
+        self.navs = {}
+
+    def get_navs(self, ticker):
+        if ticker not in self.navs:
+            self.navs[ticker] = jqka.get_navs(ticker)
+        return self.navs[ticker]
+
+    def match_fund(self, account, narration, price):
+        for fund in self.funds:
+            if account != fund.get('account', FundAccount):
+                continue
+            if 'amounts' in fund and price not in fund['amounts']:
+                continue
+            if fund.get('narration', '') not in narration:
+                continue
+            return fund
+        return None
+
+    def find_purchases(self):
+        # 一次遍历所有交易，找出记在基金账户上、还没有换算成基金份额的人民币买入
+        accounts = set(fund.get('account', FundAccount) for fund in self.funds)
+        purchases = []
+        for entry in self.entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            for posting in entry.postings:
+                if posting.account not in accounts or posting.units == None:
+                    continue
+                if posting.units.currency != 'CNY' or posting.units.number == None or posting.units.number <= 0:
+                    continue
+                fund = self.match_fund(
+                    posting.account, entry.narration, float(posting.units.number))
+                if fund != None:
+                    purchases.append((entry, posting, fund))
+        return purchases
+
+    def find_funds(self):
+        for entry, posting, fund in self.find_purchases():
+            price = float(posting.units.number)
+            date_string = entry.date.strftime("%Y%m%d")
+            fund_price = self.get_navs(fund['ticker']).get(date_string)
+            if fund_price == None:
+                continue
+            print('Updating {} at {}'.format(fund['currency'], date_string))
+            other_accounts = sorted(set(
+                other.account for other in entry.postings if other is not posting))
+            feePrice = round(price * fund['fee'], 2)
+            fund_price = float(fund_price)
+            count = (price - feePrice) / fund_price
+            self.update_line_to_new_line(posting.meta['filename'], posting.meta['lineno'], transactionTemplate.substitute(
+                fundAccount=posting.account,
+                fundCount=round(count, 2),
+                fundCurrency=fund['currency'],
+                costPrice=round(fund_price, 5),
+                feeAccount=FeeAccount,
+                fee=feePrice,
+                deviationAccount=DeviationAccount,
+                otherAccount=other_accounts[0],
+                originalPrice=posting.units.number
+            ), 1)
+
+    def update_line_to_new_line(self, filename, lineno, new_line, expand_index=0):
+        self.patch.set(filename, lineno, new_line)
         for i in range(0, expand_index):
-            lines[lineno + i] = ''
+            self.patch.set(filename, lineno + i + 1, '')
 
     def apply_beans(self):
-        for filename in self.beans:
-            #copyfile(filename, filename + '.bak')
-            with open(filename, 'w') as f:
-                f.write('\n'.join(self.beans[filename]))
+        self.patch.apply()
+
+
+def main():
+    parser = argparse.ArgumentParser("fund")
+    parser.add_argument(
+        "--entry", help="Entry bean path (default = main.bean)", default='main.bean')
+    parser.add_argument(
+        "--config", help="JSON file with the funds to process (default = funds in fund.py)")
+    parser.add_argument("--no-cache", help="Do not use the ledger load cache",
+                        action='store_true')
+    args = parser.parse_args()
+
+    config = funds
+    if args.config != None:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
 
+    entries, errors, option_map = ledger.load_file(
+        args.entry, not args.no_cache)
+    f = Fund(entries, option_map, config)
+    f.find_funds()
+    f.apply_beans()
 
-parser = argparse.ArgumentParser("import")
-parser.add_argument(
-    "--entry", help="Entry bean path (default = main.bean)", default='main.bean')
-args = parser.parse_args()
 
-entries, errors, option_map = loader.load_file(args.entry)
-f = Fund(entries, option_map)
-f.find_funds(price)
-f.apply_beans()
+if __name__ == '__main__':
+    main()
@@ -2,51 +2,84 @@ import argparse
 import re
 from datetime import date
 
-from beancount import loader
 from beancount.core import data
 from beancount.parser import parser, printer
 
-from modules.imports.alipay import Alipay
-from modules.imports.citic_credit import CITICCredit
-from modules.imports.cmb_credit import CMBCredit
-from modules.imports.cmbc_credit import CMBCCredit
-from modules.imports.icbc_debit import ICBCDebit
-from modules.imports.wechat import WeChat
-from modules.imports.yuebao import YuEBao
-
-parser = argparse.ArgumentParser("import")
-parser.add_argument("path", help="CSV Path")
-parser.add_argument(
-    "--entry", help="Entry bean path (default = main.bean)", default='main.bean')
-parser.add_argument("--out", help="Output bean path", default='out.bean')
-args = parser.parse_args()
-
-entries, errors, option_map = loader.load_file(args.entry)
-
-importers = [Alipay, WeChat, CITICCredit,
-             CMBCCredit, CMBCredit, YuEBao, ICBCDebit]
-instance = None
-for importer in importers:
-    try:
-        with open(args.path, 'rb') as f:
-            file_bytes = f.read()
-            instance = importer(args.path, file_bytes, entries, option_map)
-        break
-    except Exception as e:
-        pass
-
-if instance == None:
-    print("No suitable importer!")
-    exit(1)
-
-new_entries = instance.parse()
-
-
-with open(args.out, 'w') as f:
-    printer.print_entries(new_entries, file=f)
-
-print('Outputed to ' + args.out)
-exit(0)
+from modules import ledger
+from modules.imports.deduplicate import Deduplicate
+from modules.imports.pipeline import import_files, write_entries
+from modules.imports.watch import Watcher
+from modules.profiler import profiler
+
+
+def main():
+    parser = argparse.ArgumentParser("import")
+    parser.add_argument("path", nargs='+',
+                        help="Statement paths, globs or directories (inbox directories with --watch)")
+    parser.add_argument(
+        "--entry", help="Entry bean path (default = main.bean)", default='main.bean')
+    parser.add_argument("--out", help="Output bean path", default='out.bean')
+    parser.add_argument(
+        "--out-dir", help="Output one bean file per statement into this directory")
+    parser.add_argument("--jobs", type=int,
+                        help="Parser processes (default = CPU count, 1 = no subprocess)")
+    parser.add_argument("--no-cache", help="Do not use the ledger load cache",
+                        action='store_true')
+    parser.add_argument("--profile", help="Print time and memory used by each stage",
+                        action='store_true')
+    parser.add_argument(
+        "--profile-json", help="Also write the profile report to this JSON path")
+    parser.add_argument("--watch", help="Keep running and import statements as they land in the directories",
+                        action='store_true')
+    parser.add_argument("--interval", type=float, default=2,
+                        help="Seconds between directory scans with --watch (default = 2)")
+    parser.add_argument("--import-existing", help="With --watch, also import statements already in the directories",
+                        action='store_true')
+    args = parser.parse_args()
+
+    if args.watch:
+        # 常驻时每个账单单独输出，默认输出到 imported 目录
+        watcher = Watcher(args.entry, args.path, args.out_dir or 'imported',
+                          args.interval, not args.no_cache)
+        try:
+            watcher.run(args.import_existing)
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
+    if args.profile or args.profile_json != None:
+        profiler.enable()
+        # 子进程中的解析无法统计，未指定时改为在主进程中解析
+        if args.jobs == None:
+            args.jobs = 1
+
+    with profiler.stage('load'):
+        entries, errors, option_map = ledger.load_file(
+            args.entry, not args.no_cache)
+
+    deduplicate = Deduplicate(entries, option_map)
+    results = import_files(args.path, deduplicate, args.jobs)
+
+    if len(results) == 0:
+        print("No suitable importer!")
+        exit(1)
+
+    # 单个账单时边解析边写出，所有账单处理完后再统一写回账本
+    outputs = write_entries(results, args.out, args.out_dir)
+    deduplicate.apply_beans()
+    for out in outputs:
+        print('Outputed to ' + out)
+    if profiler.enabled:
+        profiler.print_summary()
+        if args.profile_json != None:
+            profiler.write_json(args.profile_json)
+            print('Outputed profile to ' + args.profile_json)
+    exit(0)
+
+
+# 解析在子进程中进行，需要保证子进程导入本文件时不会重复执行
+if __name__ == '__main__':
+    main()
 """
 file = parser.parse_one('''
 2018/01/15 * "测试" "测试"
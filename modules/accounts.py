@@ -1,8 +1,3 @@
-import re
-
-import dateparser
-
-
 def get_eating_account(from_user, description, time=None):
     if time == None or not hasattr(time, 'hour'):
         return 'Expenses:Eating:Others'
@@ -27,6 +22,14 @@ public_accounts = [
     'Assets:Company:Alipay:StupidAlipay'
 ]
 
+# 账单去重的匹配窗口（按导入器）：金额相同、日期相差不超过days天或时间戳相差不超过minutes分钟时视为同一笔交易
+# 未列出的导入器为同一天、时间戳相同；日期不同的交易只在当天没有同金额交易时才会匹配
+dedup_windows = {
+    # 默认只匹配同一天的交易。银行卡的入账日期可能比支付宝、微信的付款日期晚一天时，可设置如：
+    # 'CMBCredit': {'days': 1},
+    # 'CITICCredit': {'days': 1, 'minutes': 5},
+}
+
 credit_cards = {
     '中信银行': 'Liabilities:CreditCard:CITIC',
 }
@@ -60,7 +63,3 @@ anothers = {
 incomes = {
     '余额宝.*收益发放': 'Income:Trade:PnL',
 }
-
-description_res = dict([(key, re.compile(key)) for key in descriptions])
-another_res = dict([(key, re.compile(key)) for key in anothers])
-income_res = dict([(key, re.compile(key)) for key in incomes])
@@ -1,39 +1,48 @@
-from beancount.query import query, query_compile
-from beancount.query.query_env import TargetsEnvironment
 from ..accounts import *
+from ..profiler import profiler
+from .classifier import Classifier
 import csv
+from functools import lru_cache
 
 
 def replace_flag(entry, flag):
     return entry._replace(flag='!')
 
 
-def get_account_by_guess(from_user, description, time=None):
+description_classifier = Classifier(descriptions)
+another_classifier = Classifier(anothers)
+income_classifier = Classifier(incomes)
+
+
+@lru_cache(maxsize=4096)
+def guess_rule(from_user, description):
     if description != '':
-        for key, value in descriptions.items():
-            if description_res[key].findall(description):
-                if callable(value):
-                    return value(from_user, description, time)
-                else:
-                    return value
-                break
-    for key, value in anothers.items():
-        if another_res[key].findall(from_user):
-            if callable(value):
-                return value(from_user, description, time)
-            else:
-                return value
-            break
-    return "Expenses:Unknown"
+        value = description_classifier.find(description)
+        if value != None:
+            return value
+    return another_classifier.find(from_user)
+
+
+@profiler.wrap('classify')
+def get_account_by_guess(from_user, description, time=None):
+    value = guess_rule(from_user, description)
+    if value == None:
+        return "Expenses:Unknown"
+    # 与时间相关的规则只缓存匹配结果，每次重新计算账户
+    if callable(value):
+        return value(from_user, description, time)
+    return value
 
 
+@profiler.wrap('classify')
 def get_income_account_by_guess(from_user, description, time=None):
-    for key, value in incomes.items():
-        if income_res[key].findall(description):
-            return value
-    return "Income:Unknown"
+    value = income_classifier.find(description)
+    if value == None:
+        return "Income:Unknown"
+    return value
 
 
+@profiler.wrap('classify')
 def get_account_by_name(name, time=None):
     if accounts.get(name, '') == '':
         return "Unknown:" + name
@@ -75,17 +84,3 @@ class DictReaderStrip(csv.DictReader):
                 d[key] = self.restval.strip()
         return d
 
-
-class Metas(query_compile.EvalFunction):
-    __intypes__ = []
-
-    def __init__(self, operands):
-        super().__init__(operands, object)
-
-    def __call__(self, context):
-        args = self.eval_args(context)
-        meta = context.entry.meta
-        return meta
-
-
-TargetsEnvironment.functions['metas'] = Metas
@@ -1,37 +1,43 @@
 import calendar
 import csv
 from datetime import date
-from io import StringIO
+from itertools import islice
 
-import dateparser
 from beancount.core import data
 from beancount.core.data import Note, Transaction
 
 from . import (DictReaderStrip, get_account_by_guess,
                get_income_account_by_guess)
-from .base import Base
-from .deduplicate import Deduplicate
+from .base import Base, Record, drop_last
+from .timestamp import (ALIPAY_FORMATS, format_timestamp, format_trade_time,
+                        parse_time)
 
 Account支付宝 = 'Assets:Company:Alipay:StupidAlipay'
 
 
 class Alipay(Base):
+    streaming = True
 
-    def __init__(self, filename, byte_content, entries, option_map):
-        content = byte_content.decode('gbk')
-        lines = content.split("\n")
-        if (lines[0] != '支付宝交易记录明细查询\r'):
-            raise 'Not Alipay Trade Record!'
-        print('Import Alipay: ' + lines[2])
-        content = "\n".join(lines[4:len(lines) - 8])
-        self.content = content
-        self.deduplicate = Deduplicate(entries, option_map)
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        return head_bytes.startswith('支付宝交易记录明细查询'.encode('gbk'))
 
-    def parse(self):
-        content = self.content
-        f = StringIO(content)
-        reader = DictReaderStrip(f, delimiter=',')
-        transactions = []
+    def __init__(self, filename, byte_content, deduplicate):
+        self.filename = filename
+        self.byte_content = byte_content
+        lines = self.lines('gbk')
+        head = list(islice(lines, 3))
+        lines.close()
+        if (head[0] != '支付宝交易记录明细查询\r'):
+            raise ValueError('Not Alipay Trade Record!')
+        print('Import Alipay: ' + head[2])
+        self.deduplicate = deduplicate
+
+    def extract(self):
+        # 跳过4行表头和8行表尾，逐行交给csv
+        lines = drop_last(islice(self.lines('gbk'), 4, None), 8)
+        reader = DictReaderStrip(
+            (line + '\n' for line in lines), delimiter=',')
         for row in reader:
             if row['交易状态'] == '交易关闭' and row['资金状态'] == '':
                 continue
@@ -42,10 +48,10 @@ class Alipay(Base):
                 time = row['交易创建时间']
             print("Importing {} at {}".format(row['商品名称'], time))
             meta = {}
-            time = dateparser.parse(time)
+            time = parse_time(time, ALIPAY_FORMATS)
             meta['alipay_trade_no'] = row['交易号']
-            meta['trade_time'] = str(time)
-            meta['timestamp'] = str(time.timestamp()).replace('.0', '')
+            meta['trade_time'] = format_trade_time(time)
+            meta['timestamp'] = format_timestamp(time)
             account = get_account_by_guess(row['交易对方'], row['商品名称'], time)
             flag = "*"
             amount = float(row['金额（元）'])
@@ -103,8 +109,4 @@ class Alipay(Base):
 
             #b = printer.format_entry(entry)
             # print(b)
-            if not self.deduplicate.find_duplicate(entry, amount, 'alipay_trade_no'):
-                transactions.append(entry)
-
-        self.deduplicate.apply_beans()
-        return transactions
+            yield Record(entry, amount, 'alipay_trade_no')
@@ -1,6 +1,131 @@
+import io
+from collections import deque, namedtuple
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser, BytesParser
+from functools import lru_cache
+
+from ..accounts import dedup_windows
+from ..profiler import profiler
+
+# 识别文件类型时只读取文件头部
+HEAD_SIZE = 64 * 1024
+
+# 解析结果，money为None的记录（如余额断言）不参与去重
+Record = namedtuple('Record', ['entry', 'money', 'unique_no', 'replace_account'],
+                    defaults=[None, None, ''])
+
+
+@lru_cache(maxsize=8)
+def get_email_subject(head_bytes):
+    # 只解析邮件头，不解码正文
+    header = BytesHeaderParser().parsebytes(head_bytes)
+    subject = header.get('subject')
+    if subject == None:
+        return ''
+    try:
+        return str(make_header(decode_header(subject)))
+    except (LookupError, UnicodeDecodeError):
+        return str(subject)
+
+
+def get_email_html(byte_content):
+    # 只解码第一个text/html部分，其他正文和附件都不解码
+    message = BytesParser().parsebytes(byte_content)
+    for part in message.walk():
+        if part.get_content_type() != 'text/html':
+            continue
+        payload = part.get_payload(decode=True)
+        charset = part.get_content_charset()
+        if charset == None:
+            try:
+                return payload.decode('utf-8')
+            except UnicodeDecodeError:
+                return payload.decode('gb18030', 'ignore')
+        try:
+            return payload.decode(charset, 'ignore')
+        except LookupError:
+            return payload.decode('ascii', 'ignore')
+    return None
+
+
+def parse_html(content):
+    # 用lxml解析，比BeautifulSoup(content, 'html.parser')快得多；识别为网页账单后才导入
+    from lxml import html
+    return html.document_fromstring(
+        content.encode('utf-8'), parser=html.HTMLParser(encoding='utf-8'))
+
+
+class XPaths:
+    # 导入器用到的选择器，第一次使用时编译，之后同一导入器的所有账单复用
+
+    def __init__(self, **expressions):
+        self.expressions = expressions
+        self.compiled = {}
+
+    def __getattr__(self, name):
+        if name not in self.expressions:
+            raise AttributeError(name)
+        if name not in self.compiled:
+            from lxml import etree
+            self.compiled[name] = etree.XPath(self.expressions[name])
+        return self.compiled[name]
+
+
+def drop_last(iterable, count):
+    # 丢弃最后count项，不需要先读入全部内容
+    buffer = deque()
+    for item in iterable:
+        buffer.append(item)
+        if len(buffer) > count:
+            yield buffer.popleft()
+
+
 class Base():
-    def __init__(self, filename, byte_content, entries, option_map):
-        raise 'Not implemented!'
+    # 为True时，byte_content可能为None，需要用open()/lines()从文件中流式读取
+    streaming = False
+
+    def __init__(self, filename, byte_content, deduplicate):
+        raise NotImplementedError('Not implemented!')
+
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        # 只根据扩展名、文件头或邮件标题判断，不能做耗时的解析
+        return False
+
+    def open(self):
+        if self.byte_content != None:
+            return io.BytesIO(self.byte_content)
+        return open(self.filename, 'rb')
+
+    def lines(self, encoding):
+        # 逐行增量解码，结果与 decode(encoding).split('\n') 相同
+        with self.open() as f:
+            text = io.TextIOWrapper(f, encoding=encoding, newline='\n')
+            line = ''
+            for line in text:
+                yield line[:-1] if line.endswith('\n') else line
+            if line == '' or line.endswith('\n'):
+                yield ''
+
+    def extract(self):
+        # 只做解析，不碰去重和账本，可在子进程中运行
+        return []
+
+    @classmethod
+    def filter(cls, records, deduplicate):
+        for record in records:
+            if record.money == None:
+                yield record.entry
+                continue
+            if not deduplicate.find_duplicate(record.entry, record.money, record.unique_no, record.replace_account,
+                                              window=dedup_windows.get(cls.__name__), source=cls.__name__):
+                deduplicate.add_entry(record.entry, cls.__name__)
+                profiler.count('dedup.new')
+                yield record.entry
+            else:
+                profiler.count('dedup.hits')
 
     def parse(self):
-        pass
+        records = profiler.iterate(
+            'parse.' + type(self).__name__, self.extract())
+        return list(profiler.iterate('dedup', self.filter(records, self.deduplicate)))
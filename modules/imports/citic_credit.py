@@ -3,58 +3,67 @@ import csv
 from datetime import date
 from io import StringIO
 
-import dateparser
-import eml_parser
 from beancount.core import data
 from beancount.core.data import Note, Transaction
-from bs4 import BeautifulSoup
 
 from . import (DictReaderStrip, get_account_by_guess,
                get_income_account_by_guess)
-from .base import Base
-from .deduplicate import Deduplicate
+from .base import (HEAD_SIZE, Base, Record, XPaths, get_email_html,
+                   get_email_subject, parse_html)
 
 Account中信 = 'Liabilities:CreditCard:CITIC'
+# 与原先的CSS选择器匹配规则相同，注释中为对应的选择器
+xpaths = XPaths(
+    # #fixBand16
+    balance='//*[@id="fixBand16"]',
+    # #fixBand7
+    bands='//*[@id="fixBand7"]',
+    # band.select('td>table>tbody>tr>td')
+    band_tds='descendant::td[parent::tr[parent::tbody[parent::table[parent::td]]]]',
+)
 
 
-class CITICCredit():
+class CITICCredit(Base):
 
-    def __init__(self, filename, byte_content, entries, option_map):
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        return filename.endswith('eml') and '中信银行' in get_email_subject(head_bytes)
+
+    def __init__(self, filename, byte_content, deduplicate):
         if not filename.endswith('eml'):
-            raise 'Not CITIC!'
-        parsed_eml = eml_parser.eml_parser.decode_email_b(
-            byte_content, include_raw_body=True)
-        if not '中信银行' in parsed_eml['header']['subject']:
-            raise 'Not CITIC!'
-        content = parsed_eml['body'][1]['content']
-        # for body in parsed_eml['body']:
-        #content += body['content']
-        self.soup = BeautifulSoup(content, 'html.parser')
+            raise ValueError('Not CITIC!')
+        # 先只看邮件标题，是该账单时才解码HTML正文
+        subject = get_email_subject(byte_content[:HEAD_SIZE])
+        if not '中信银行' in subject:
+            raise ValueError('Not CITIC!')
+        content = get_email_html(byte_content)
+        if content == None:
+            raise ValueError('Not CITIC!')
+        self.document = parse_html(content)
         self.content = content
-        self.deduplicate = Deduplicate(entries, option_map)
+        self.deduplicate = deduplicate
 
     def change_currency(self, currency):
         if currency == 'RMB':
             return 'CNY'
         return currency
 
-    def parse(self):
-        d = self.soup
-        balance = d.select('#fixBand16')[0].text.replace('RMB', '').strip()
-        bands = d.select('#fixBand7')
-        transactions = []
+    def extract(self):
+        d = self.document
+        balance = xpaths.balance(d)[0].text_content().replace('RMB', '').strip()
+        bands = xpaths.bands(d)
         for band in bands:
-            tds = band.select('td>table>tbody>tr>td')
-            trade_date = tds[1].text.strip()
+            tds = xpaths.band_tds(band)
+            trade_date = tds[1].text_content().strip()
             if trade_date == '':
                 continue
             time = date(int(trade_date[0:4]), int(
                 trade_date[4:6]), int(trade_date[6:8]))
-            description = tds[4].text.strip()
-            trade_currency = self.change_currency(tds[5].text.strip())
-            trade_price = tds[6].text.strip()
-            real_currency = self.change_currency(tds[7].text.strip())
-            real_price = tds[8].text.strip()
+            description = tds[4].text_content().strip()
+            trade_currency = self.change_currency(tds[5].text_content().strip())
+            trade_price = tds[6].text_content().strip()
+            real_currency = self.change_currency(tds[7].text_content().strip())
+            real_price = tds[8].text_content().strip()
             print("Importing {} at {}".format(description, time))
             account = get_account_by_guess(description, '', time)
             flag = "*"
@@ -79,8 +88,4 @@ class CITICCredit():
             data.create_simple_posting(
                 entry, account, trade_price, trade_currency)
             data.create_simple_posting(entry, Account中信, None, None)
-            if not self.deduplicate.find_duplicate(entry, -amount, None, Account中信):
-                transactions.append(entry)
-
-        self.deduplicate.apply_beans()
-        return transactions
+            yield Record(entry, -amount, None, Account中信)
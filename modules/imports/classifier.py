@@ -0,0 +1,99 @@
+import re
+from collections import deque
+
+# 只由字面量和 | 组成的规则可以放进自动机
+LITERAL_RE = re.compile(r'[^.^$*+?{}\[\]\\|()]*')
+
+
+def split_literals(key):
+    parts = key.split('|')
+    for part in parts:
+        if not LITERAL_RE.fullmatch(part):
+            return None
+    return parts
+
+
+class Automaton:
+    # Aho-Corasick自动机，一次扫描找出文本中出现的、序号最小的规则
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [None]
+
+    def add(self, word, index):
+        state = 0
+        for char in word:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(None)
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        if self.out[state] == None or index < self.out[state]:
+            self.out[state] = index
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(char, 0)
+                self.fail[next_state] = fail
+                if self.out[fail] != None and (self.out[next_state] == None or self.out[fail] < self.out[next_state]):
+                    self.out[next_state] = self.out[fail]
+
+    def search(self, text):
+        best = self.out[0]
+        state = 0
+        for char in text:
+            if best == 0:
+                break
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            index = self.out[state]
+            if index != None and (best == None or index < best):
+                best = index
+        return best
+
+
+class Classifier:
+    # 先到先得：返回按顺序第一条能在文本任意位置匹配的规则，与逐条 findall 一致
+
+    def __init__(self, rules):
+        self.keys = list(rules.keys())
+        self.values = list(rules.values())
+        self.automaton = None
+        self.patterns = []
+        self.compile()
+
+    def compile(self):
+        automaton = Automaton()
+        for index, key in enumerate(self.keys):
+            literals = split_literals(key)
+            if literals == None:
+                self.patterns.append((index, re.compile(key)))
+                continue
+            for literal in literals:
+                automaton.add(literal, index)
+        automaton.build()
+        self.automaton = automaton
+
+    def find(self, text):
+        # 返回第一条匹配的规则的值（字符串或函数），没有则返回None
+        best = self.automaton.search(text)
+        # 正则规则只需检查排在自动机结果之前的那些
+        for index, pattern in self.patterns:
+            if best != None and index > best:
+                break
+            if pattern.search(text):
+                best = index
+                break
+        if best == None:
+            return None
+        return self.values[best]
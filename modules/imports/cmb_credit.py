@@ -3,16 +3,14 @@ import csv
 from datetime import date
 from io import StringIO
 
-import dateparser
-import eml_parser
 from beancount.core import data
 from beancount.core.data import Amount, Balance, Decimal, Posting, Transaction
-from bs4 import BeautifulSoup
 
 from . import (DictReaderStrip, get_account_by_guess,
                get_income_account_by_guess)
-from .base import Base
-from .deduplicate import Deduplicate
+from .base import (HEAD_SIZE, Base, Record, XPaths, get_email_html,
+                   get_email_subject, parse_html)
+from .timestamp import CMB_FORMATS, parse_time
 
 Account招商 = 'Liabilities:CreditCard:CMB'
 trade_area_list = {
@@ -21,23 +19,38 @@ trade_area_list = {
     'JP': 'JPY',
     'HK': 'HKD'
 }
+# 与原先的CSS选择器匹配规则相同，注释中为对应的选择器
+xpaths = XPaths(
+    # #fixBand38 div font
+    date_range='//*[@id="fixBand38"]//div//font',
+    # #fixBand40 div font
+    balance='//*[@id="fixBand40"]//div//font',
+    # #fixBand29 #loopBand2>table>tbody>tr
+    bands='//*[@id="fixBand29"]//*[@id="loopBand2"]/table/tbody/tr',
+    # band.select('td #fixBand15 table table td')
+    band_tds='descendant::td[ancestor::table[ancestor::table[ancestor::*[@id="fixBand15"][ancestor::td]]]]',
+)
 
 
-class CMBCredit():
+class CMBCredit(Base):
 
-    def __init__(self, filename, byte_content, entries, option_map):
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        return filename.endswith('eml') and '招商银行信用卡' in get_email_subject(head_bytes)
+
+    def __init__(self, filename, byte_content, deduplicate):
         if not filename.endswith('eml'):
-            raise 'Not CMB!'
-        parsed_eml = eml_parser.eml_parser.decode_email_b(
-            byte_content, include_raw_body=True)
-        if not '招商银行信用卡' in parsed_eml['header']['subject']:
-            raise 'Not CMB!'
-        content = parsed_eml['body'][1]['content']
-        # for body in parsed_eml['body']:
-        #content += body['content']
-        self.soup = BeautifulSoup(content, 'html.parser')
+            raise ValueError('Not CMB!')
+        # 先只看邮件标题，是该账单时才解码HTML正文
+        subject = get_email_subject(byte_content[:HEAD_SIZE])
+        if not '招商银行信用卡' in subject:
+            raise ValueError('Not CMB!')
+        content = get_email_html(byte_content)
+        if content == None:
+            raise ValueError('Not CMB!')
+        self.document = parse_html(content)
         self.content = content
-        self.deduplicate = Deduplicate(entries, option_map)
+        self.deduplicate = deduplicate
         self.date = date.today()
 
     def change_currency(self, currency):
@@ -58,18 +71,16 @@ class CMBCredit():
             ret = ret.replace(ret.year - 1)
         return ret
 
-    def parse(self):
-        d = self.soup
-        transactions = []
-        # balance = d.select('#fixBand16')[0].text.replace('RMB', '').strip()
-        date_range = d.select('#fixBand38 div font')[0].text.strip()
-        transaction_date = dateparser.parse(
-            date_range.split('-')[1].split('(')[0])
+    def extract(self):
+        d = self.document
+        date_range = xpaths.date_range(d)[0].text_content().strip()
+        transaction_date = parse_time(
+            date_range.split('-')[1].split('(')[0], CMB_FORMATS)
         transaction_date = date(transaction_date.year,
                                 transaction_date.month, transaction_date.day)
         self.date = transaction_date
         balance = '-' + \
-            d.select('#fixBand40 div font')[0].text.replace(
+            xpaths.balance(d)[0].text_content().replace(
                 '￥', '').replace(',', '').strip()
         entry = Balance(
             account=Account招商,
@@ -79,24 +90,24 @@ class CMBCredit():
             diff_amount=Amount(Decimal('0'), 'CNY'),
             date=self.date
         )
-        transactions.append(entry)
+        yield Record(entry)
 
-        bands = d.select('#fixBand29 #loopBand2>table>tbody>tr')
+        bands = xpaths.bands(d)
         for band in bands:
-            tds = band.select('td #fixBand15 table table td')
+            tds = xpaths.band_tds(band)
             if len(tds) == 0:
                 continue
-            trade_date = tds[1].text.strip()
+            trade_date = tds[1].text_content().strip()
             if trade_date == '':
-                trade_date = tds[2].text.strip()
+                trade_date = tds[2].text_content().strip()
             time = self.get_date(trade_date)
-            full_descriptions = tds[3].text.strip().split('-')
+            full_descriptions = tds[3].text_content().strip().split('-')
             payee = full_descriptions[0]
             description = '-'.join(full_descriptions[1:])
-            trade_currency = self.change_currency(tds[6].text.strip())
-            trade_price = tds[7].text.replace('\xa0', '').strip()
+            trade_currency = self.change_currency(tds[6].text_content().strip())
+            trade_price = tds[7].text_content().replace('\xa0', '').strip()
             real_currency = 'CNY'
-            real_price = tds[4].text.replace(
+            real_price = tds[4].text_content().replace(
                 '￥', '').replace('\xa0', '').strip()
             print("Importing {} at {}".format(description, time))
             account = get_account_by_guess(description, '', time)
@@ -122,8 +133,4 @@ class CMBCredit():
                 entry.postings.append(posting)
 
             data.create_simple_posting(entry, Account招商, None, None)
-            if not self.deduplicate.find_duplicate(entry, -amount, None, Account招商):
-                transactions.append(entry)
-
-        self.deduplicate.apply_beans()
-        return transactions
+            yield Record(entry, -amount, None, Account招商)
@@ -3,36 +3,48 @@ import csv
 from datetime import date
 from io import StringIO
 
-import dateparser
-import eml_parser
 from beancount.core import data
 from beancount.core.data import Note, Transaction
-from bs4 import BeautifulSoup
 
 from . import (DictReaderStrip, get_account_by_guess,
                get_income_account_by_guess)
-from .base import Base
-from .deduplicate import Deduplicate
+from .base import (HEAD_SIZE, Base, Record, XPaths, get_email_html,
+                   get_email_subject, parse_html)
 
 Account民生 = 'Liabilities:CreditCard:CMBC'
+# 与原先的CSS选择器匹配规则相同，注释中为对应的选择器
+xpaths = XPaths(
+    # #loopBand2>table>tbody>tr
+    tables='//*[@id="loopBand2"]/table/tbody/tr',
+    # title.select('#fixBand29 td>table td')
+    currency='descendant::td[ancestor::table[parent::td[ancestor::*[@id="fixBand29"]]]]',
+    # contents.select('#loopBand3>table>tbody>tr')
+    bands='descendant::tr[parent::tbody[parent::table[parent::*[@id="loopBand3"]]]]',
+    # band.select('td>table>tbody>tr>td #fixBand9>table>tbody>tr>td>table>tbody>tr>td')
+    band_tds='descendant::td[parent::tr[parent::tbody[parent::table[parent::td[parent::tr[parent::tbody[parent::table['
+    'parent::*[@id="fixBand9"][ancestor::td[parent::tr[parent::tbody[parent::table[parent::td]]]]]]]]]]]]]',
+)
 
 
-class CMBCCredit():
+class CMBCCredit(Base):
 
-    def __init__(self, filename, byte_content, entries, option_map):
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        return filename.endswith('eml') and '民生信用卡' in get_email_subject(head_bytes)
+
+    def __init__(self, filename, byte_content, deduplicate):
         if not filename.endswith('eml'):
-            raise 'Not CMBC!'
-        parsed_eml = eml_parser.eml_parser.decode_email_b(
-            byte_content, include_raw_body=True)
-        title = parsed_eml['header']['subject']
+            raise ValueError('Not CMBC!')
+        # 先只看邮件标题，是该账单时才解码HTML正文
+        title = get_email_subject(byte_content[:HEAD_SIZE])
         if not '民生信用卡' in title:
-            raise 'Not CMBC!'
-        content = parsed_eml['body'][1]['content']
-        # for body in parsed_eml['body']:
-        #content += body['content']
-        self.soup = BeautifulSoup(content, 'html.parser')
+            raise ValueError('Not CMBC!')
+        content = get_email_html(byte_content)
+        if content == None:
+            raise ValueError('Not CMBC!')
+        self.document = parse_html(content)
         self.content = content
-        self.deduplicate = Deduplicate(entries, option_map)
+        self.deduplicate = deduplicate
         self.year = int(title.split('信用卡')[1].split('年')[0])
         self.month = int(title.split('年')[1].split('月')[0])
 
@@ -49,23 +61,21 @@ class CMBCCredit():
             year -= 1
         return date(year, int(splitted_date[0]), int(splitted_date[1]))
 
-    def parse(self):
-        d = self.soup
-        tables = d.select('#loopBand2>table>tbody>tr')
+    def extract(self):
+        d = self.document
+        tables = xpaths.tables(d)
         currencies_count = int(len(tables) / 4)
-        transactions = []
         for x in range(0, currencies_count):
             title = tables[x * 4]
             contents = tables[x * 4 + 3]
-            currency = title.select('#fixBand29 td>table td')[1].text.strip()
+            currency = xpaths.currency(title)[1].text_content().strip()
             currency = self.get_currency(currency)
-            bands = contents.select('#loopBand3>table>tbody>tr')
+            bands = xpaths.bands(contents)
             for band in bands:
-                tds = band.select(
-                    'td>table>tbody>tr>td #fixBand9>table>tbody>tr>td>table>tbody>tr>td')
-                time = self.get_date(tds[1].text.strip())
-                description = tds[3].text.strip()
-                price = tds[4].text.strip()
+                tds = xpaths.band_tds(band)
+                time = self.get_date(tds[1].text_content().strip())
+                description = tds[3].text_content().strip()
+                price = tds[4].text_content().strip()
                 print("Importing {} at {}".format(description, time))
                 account = get_account_by_guess(description, '', time)
                 flag = "*"
@@ -89,8 +99,4 @@ class CMBCCredit():
                 )
                 data.create_simple_posting(entry, account, price, currency)
                 data.create_simple_posting(entry, Account民生, None, None)
-                if not self.deduplicate.find_duplicate(entry, -amount, None, Account民生):
-                    transactions.append(entry)
-
-        self.deduplicate.apply_beans()
-        return transactions
+                yield Record(entry, -amount, None, Account民生)
@@ -1,8 +1,99 @@
-from shutil import copyfile
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
 
-from beancount.query import query
+from beancount.core import convert, interpolate, prices
+from beancount.core.data import Transaction
+from beancount.core.number import D
 
 from ..accounts import public_accounts
+from ..patch import LedgerPatch
+from ..profiler import profiler
+
+
+def to_cents(number):
+    return int((D(str(number)) * 100).to_integral_value())
+
+
+def parse_timestamp(value):
+    try:
+        return float(str(value).replace("'", ''))
+    except ValueError:
+        return None
+
+
+def shift_lineno(shifts, filename, lineno):
+    # shifts: {filename: (修改过的行号, 截至该行累计插入的行数)}，只有在之前插入的行会影响行号
+    if filename not in shifts or lineno == None:
+        return lineno
+    linenos, totals = shifts[filename]
+    i = bisect_left(linenos, lineno)
+    return lineno + totals[i - 1] if i > 0 else lineno
+
+
+class IndexedEntry:
+    # 同一笔交易的所有posting共享，补丁后只需更新一处
+    __slots__ = ('flag', 'date', 'filename', 'lineno', 'timestamp', 'time', 'metas', 'pending',
+                 'transaction')
+
+    def __init__(self, entry, pending=False):
+        self.flag = entry.flag
+        self.date = entry.date
+        self.filename = entry.meta.get('filename')
+        self.lineno = entry.meta.get('lineno')
+        self.timestamp = str(entry.meta.get('timestamp'))
+        self.time = parse_timestamp(self.timestamp)
+        self.metas = dict(entry.meta)
+        # False: 账本中的交易；导入器名：本批次新导入、尚未输出的交易；True: 已经输出的交易
+        self.pending = pending
+        # 本批次新导入的交易，去重时直接修改它，而不是修改账本
+        self.transaction = entry if pending else None
+
+
+class IndexItem:
+    # 与原先BQL查询返回的每一行字段保持一致
+    __slots__ = ('entry', 'location', 'account', 'number', 'date', 'time')
+
+    def __init__(self, entry, location, account, number):
+        self.entry = entry
+        self.location = location
+        self.account = account
+        self.number = number
+        # 查询时频繁用到，不经过 __getattr__
+        self.date = entry.date
+        self.time = entry.time
+
+    def __getattr__(self, name):
+        return getattr(self.entry, name)
+
+
+class AmountIndex:
+    # 同一金额的所有posting，分别按日期和时间戳排序，用二分查找取出窗口内的交易
+    __slots__ = ('dates', 'date_items', 'times', 'time_items')
+
+    def __init__(self):
+        self.dates = []
+        self.date_items = []
+        self.times = []
+        self.time_items = []
+
+    def add(self, item):
+        i = bisect_right(self.dates, item.date)
+        self.dates.insert(i, item.date)
+        self.date_items.insert(i, item)
+        if item.time != None:
+            i = bisect_right(self.times, item.time)
+            self.times.insert(i, item.time)
+            self.time_items.insert(i, item)
+
+    def by_date(self, date, days):
+        start = bisect_left(self.dates, date - timedelta(days))
+        end = bisect_right(self.dates, date + timedelta(days))
+        return self.date_items[start:end]
+
+    def by_time(self, time, seconds):
+        start = bisect_left(self.times, time - seconds)
+        end = bisect_right(self.times, time + seconds)
+        return self.time_items[start:end]
 
 
 class Deduplicate:
@@ -10,90 +101,253 @@ class Deduplicate:
     def __init__(self, entries, option_map):
         self.entries = entries
         self.option_map = option_map
-        self.beans = {}
+        self.patch = LedgerPatch()
+        self.price_map = None
+        self.indexed_entries = {}
+        self.pending_entries = []
+        # id(新导入的交易) -> 修改flag后的交易
+        self.replaced_entries = {}
+        # currency -> {cents: AmountIndex}
+        self.indexes = {}
+        # 每次写回账本后的行号变化，self.entries中的行号仍是加载时的
+        self.line_shifts = []
+
+    def get_index(self, currency):
+        if currency in self.indexes:
+            return self.indexes[currency]
+        with profiler.stage('dedup.index'):
+            return self.build_index(currency)
+
+    def build_index(self, currency):
+        if self.price_map is None:
+            self.price_map = prices.build_price_map(self.entries)
+        index = {}
+        for entry in self.entries:
+            if isinstance(entry, Transaction):
+                self.index_entry(index, entry, currency)
+        for entry in self.pending_entries:
+            self.index_entry(index, entry, currency, True)
+        self.indexes[currency] = index
+        return index
+
+    def index_entry(self, index, entry, currency, pending=False):
+        indexed = self.indexed_entries.get(id(entry))
+        if indexed is None:
+            indexed = IndexedEntry(entry, pending)
+            indexed.lineno = self.current_lineno(indexed.filename, indexed.lineno)
+            self.indexed_entries[id(entry)] = indexed
+        postings = entry.postings
+        if pending:
+            postings = self.complete_postings(postings)
+        for posting in postings:
+            if posting.units is None or posting.units.number is None:
+                continue
+            # 等价于 number(convert(units(position), currency))
+            units = convert.convert_amount(
+                posting.units, currency, self.price_map, None)
+            meta = posting.meta or {}
+            filename = meta.get('filename', 'N/A')
+            location = '{}:{:d}:'.format(
+                filename, self.current_lineno(filename, meta.get('lineno', 0)))
+            item = IndexItem(indexed, location, posting.account, units.number)
+            cents = to_cents(units.number)
+            amounts = index.get(cents)
+            if amounts is None:
+                amounts = index[cents] = AmountIndex()
+            amounts.add(item)
 
-    def find_duplicate(self, entry, money, unique_no=None, replace_account='', currency='CNY'):
+    def complete_postings(self, postings):
+        # 新导入的交易尚未经过booking，需要自己补全留空金额的posting
+        complete = [posting for posting in postings
+                    if posting.units is not None and posting.units.number is not None]
+        missing = [posting for posting in postings
+                   if posting.units is None or posting.units.number is None]
+        if len(missing) != 1:
+            return complete
+        positions = interpolate.compute_residual(complete).get_positions()
+        if len(positions) != 1:
+            return complete
+        return complete + [missing[0]._replace(units=-positions[0].units)]
+
+    def add_entry(self, entry, source=True):
+        # 新导入的交易也放入索引，避免同一批次内重复导入同一订单
+        # source为导入器名时，之后其他导入器的同一笔交易也会与它去重
+        self.pending_entries.append(entry)
+        self.indexed_entries[id(entry)] = IndexedEntry(entry, source)
+        for currency, index in self.indexes.items():
+            self.index_entry(index, entry, currency, True)
+
+    def current_entry(self, entry):
+        # 本批次新导入的交易被标记为 ! 后的新对象，meta和postings与原对象共享
+        return self.replaced_entries.get(id(entry), entry)
+
+    def find_items(self, date, money, currency, days=0, time=None, seconds=0):
+        # 金额相同、日期相差不超过days天或时间戳相差不超过seconds秒的交易，按日期远近和时间戳排序
+        number = D(str(money))
+        amounts = self.get_index(currency).get(to_cents(money))
+        if amounts is None:
+            return []
+        items = amounts.by_date(date, days)
+        if time != None:
+            # 时间戳在窗口内的交易不受日期窗口限制，例如跨零点的交易
+            found = set(id(item) for item in items)
+            items = items + [item for item in amounts.by_time(time, seconds)
+                             if id(item) not in found]
+        items = [item for item in items if item.number == number]
+        if days == 0 and time == None:
+            return sorted(items, key=lambda item: item.timestamp)
+        return sorted(items, key=lambda item: (abs(item.date - date), item.timestamp))
+
+    @profiler.wrap('dedup.query')
+    def find_duplicate(self, entry, money, unique_no=None, replace_account='', currency='CNY', window=None, source=None):
+        # window为该账单的匹配窗口 {'days': 天数, 'minutes': 分钟数}，默认为同一天、时间戳相同
+        window = window or {}
+        days = window.get('days', 0)
+        seconds = window.get('minutes', 0) * 60
+        timestamp = None
+        if 'timestamp' in entry.meta:
+            timestamp = parse_timestamp(entry.meta['timestamp'])
         # 要查询的是实际付款的账户，而不是支出信息
-        bql = "SELECT flag, filename, lineno, location, account, year, month, day, str(entry_meta('timestamp')) as timestamp, metas() as metas WHERE year = {} AND month = {} AND day = {} AND number(convert(units(position), '{}')) = {} ORDER BY timestamp ASC".format(
-            entry.date.year, entry.date.month, entry.date.day, currency, money)
-        items = query.run_query(self.entries, self.option_map, bql)
-        length = len(items[1])
-        if (length == 0):
-            return False
-        updated_items = []
-        for item in items[1]:
-            same_trade = False
-            item_timestamp = item.timestamp.replace("'", '')
-            # 如果已经被录入了，且unique_no相同，则判定为是同导入器导入的同交易，啥都不做
-            if unique_no != None:
-                if unique_no in entry.meta and unique_no in item.metas:
-                    if item.metas[unique_no] == entry.meta[unique_no]:
-                        same_trade = True
-                    # unique_no存在但不同，那就绝对不是同一笔交易了
-                    # 这个时候就直接返回不存在同订单
-                    else:
-                        return False
-            if same_trade:
-                return True
-            # 否则，可能是不同账单的同交易，此时判断时间
-            # 如果时间戳相同，或某个导入器的数据没有时间戳，则判断其为「还需进一步处理」的同笔交易
-            # 例如，手工输入的交易，打上支付宝订单号。
+        items = self.find_items(
+            entry.date, money, currency, days, timestamp, seconds)
+        # 如果已经被录入了，且unique_no相同，则判定为是同导入器导入的同交易，啥都不做
+        if unique_no != None and unique_no in entry.meta:
+            for item in items:
+                if unique_no in item.metas and item.metas[unique_no] == entry.meta[unique_no]:
+                    return True
+            # unique_no存在但不同，那就绝对不是同一笔交易了
+            items = [item for item in items if not unique_no in item.metas]
+        # 已输出的和同一导入器新导入的交易只用于订单号去重，本批次其他导入器新导入的交易照常去重
+        items = [item for item in items if not item.pending or (
+            item.pending != True and item.pending != source)]
+        # 否则，可能是不同账单的同交易，此时判断时间
+        # 如果时间戳在窗口内，则判定为同交易，只取最接近的一笔
+        # 100%确认是同一笔交易后，就没必要再给其他的「金额相同」的交易加信息了
+        if 'timestamp' in entry.meta and timestamp != None:
+            timed = [item for item in items if item.time != None and abs(
+                item.time - timestamp) <= seconds]
+            if len(timed) > 0:
+                items = [min(timed, key=lambda item: abs(item.time - timestamp))]
+            else:
+                # 某个导入器的数据没有时间戳时，判断其为「还需进一步处理」的同笔交易
+                # 例如，手工输入的交易，打上支付宝订单号。
+                items = [item for item in items if item.time == None]
+        # 日期不同的交易只可能是同一笔付款在别的账单中的记录：
+        # 支付手段尚未确定（公共账户），或是同一账户的无时间戳交易（如手工录入）
+        items = [item for item in items if item.date == entry.date or item.account in public_accounts or (
+            replace_account != '' and item.account == replace_account and item.time == None)]
+        # 窗口内日期不同的交易，只在日期更近的没有时才使用
+        if len(items) > 0:
+            nearest = abs(items[0].date - entry.date)
+            items = [item for item in items if abs(
+                item.date - entry.date) == nearest]
+        for item in items:
+            if item.pending:
+                self.merge_pending(item, entry, replace_account)
+                continue
             # 另外因为支付宝的傻逼账单，这里还需要承担支付手段更新的功能
-            if (
-                (not 'timestamp' in entry.meta) or
-                item_timestamp == entry.meta['timestamp'] or
-                item.timestamp == 'None' or
-                item.timestamp == ''
-            ):
-                updated_items.append(item)
-                if replace_account != '' and item.account in public_accounts:
-                    self.update_transaction_account(
-                        item.location, item.account, replace_account)
-                for key, value in entry.meta.items():
-                    if key == 'filename' or key == 'lineno':
-                        continue
-                    if not key in item.metas:
-                        self.append_text_to_transaction(
-                            item.filename, item.lineno, '{}: "{}"'.format(key, value))
-                # 如果有时间戳，且时间戳相同，则判定为同交易
-                # 100%确认是同一笔交易后，就没必要再给其他的「金额相同」的交易加信息了
-                if 'timestamp' in entry.meta and item_timestamp == entry.meta['timestamp']:
-                    break
-        if len(updated_items) > 1:
-            for item in updated_items:
+            if replace_account != '' and item.account in public_accounts:
+                self.update_transaction_account(
+                    item.location, item.account, replace_account)
+                item.account = replace_account
+            for key, value in entry.meta.items():
+                if key == 'filename' or key == 'lineno':
+                    continue
+                if not key in item.metas:
+                    self.append_text_to_transaction(
+                        item.filename, item.lineno, '{}: "{}"'.format(key, value))
+                    item.metas[key] = value
+        if len(items) > 1:
+            for item in items:
+                if item.pending:
+                    self.flag_pending(item.entry, '!')
+                    continue
                 self.update_transaction_flag(item.location, item.flag, '!')
-        return len(updated_items) > 0
+                item.entry.flag = '!'
+        return len(items) > 0
 
-    def read_bean(self, filename):
-        if filename in self.beans:
-            return self.beans[filename]
-        with open(filename, 'r') as f:
-            text = f.read()
-            self.beans[filename] = text.split('\n')
-        return self.beans[filename]
+    def merge_pending(self, item, entry, replace_account):
+        # 与账本中的交易相同，只是直接修改还未输出的交易
+        transaction = item.entry.transaction
+        if replace_account != '' and item.account in public_accounts:
+            postings = transaction.postings
+            for i, posting in enumerate(postings):
+                if posting.account == item.account:
+                    postings[i] = posting._replace(account=replace_account)
+            print("Updated account from {} to {} at {} {}".format(
+                item.account, replace_account, transaction.date, transaction.narration))
+            item.account = replace_account
+        for key, value in entry.meta.items():
+            if key == 'filename' or key == 'lineno':
+                continue
+            if not key in item.metas:
+                transaction.meta[key] = value
+                item.metas[key] = value
+
+    def flag_pending(self, indexed, flag):
+        transaction = indexed.transaction
+        self.replaced_entries[id(transaction)] = self.current_entry(
+            transaction)._replace(flag=flag)
+        indexed.flag = flag
+        print("Updated flag to {} at {} {}".format(
+            flag, transaction.date, transaction.narration))
 
     def update_transaction_account(self, location, old_account, new_account):
         file_items = location.split(':')
         lineno = int(file_items[1])
-        lines = self.read_bean(file_items[0])
-        lines[lineno - 1] = lines[lineno - 1].replace(old_account, new_account)
+        self.patch.replace(file_items[0], lineno, old_account, new_account)
+        profiler.count('dedup.patches')
         print("Updated account from {} to {} at {}".format(
             old_account, new_account, location))
 
     def append_text_to_transaction(self, filename, lineno, text):
-        lines = self.read_bean(filename)
-        lines[lineno - 1] += '\n	' + text
+        self.patch.append(filename, lineno, '	' + text)
+        profiler.count('dedup.patches')
         print("Appended meta {} to {}:{}".format(text, filename, lineno))
 
     def update_transaction_flag(self, location, old_flag, new_flag):
         file_items = location.split(':')
         lineno = int(file_items[1])
-        lines = self.read_bean(file_items[0])
-        lines[lineno - 1] = lines[lineno - 1].replace(old_flag, new_flag, 1)
+        self.patch.replace(file_items[0], lineno, old_flag, new_flag, 1)
+        profiler.count('dedup.patches')
         print("Updated flag to {} at {}".format(new_flag, location))
 
+    def current_lineno(self, filename, lineno):
+        for shifts in self.line_shifts:
+            lineno = shift_lineno(shifts, filename, lineno)
+        return lineno
+
+    def shift_lines(self, inserted):
+        # 写回账本插入了新行，更新索引中的行号，之后的修改仍能写到正确的位置，不必重新加载账本
+        shifts = {}
+        for filename, lines in inserted.items():
+            linenos = []
+            totals = []
+            total = 0
+            for lineno, count in lines:
+                if count == 0:
+                    continue
+                total += count
+                linenos.append(lineno)
+                totals.append(total)
+            if len(linenos) > 0:
+                shifts[filename] = (linenos, totals)
+        if len(shifts) == 0:
+            return
+        self.line_shifts.append(shifts)
+        for indexed in self.indexed_entries.values():
+            indexed.lineno = shift_lineno(shifts, indexed.filename, indexed.lineno)
+        for index in self.indexes.values():
+            for amounts in index.values():
+                for item in amounts.date_items:
+                    filename, lineno = item.location[:-1].rsplit(':', 1)
+                    if filename in shifts:
+                        item.location = '{}:{:d}:'.format(
+                            filename, shift_lineno(shifts, filename, int(lineno)))
+
     def apply_beans(self):
-        for filename in self.beans:
-            copyfile(filename, filename + '.bak')
-            with open(filename, 'w') as f:
-                f.write('\n'.join(self.beans[filename]))
+        with profiler.stage('apply'):
+            self.shift_lines(self.patch.apply())
+        # 新导入的交易此时都已输出，之后只用于订单号去重
+        for entry in self.pending_entries:
+            self.indexed_entries[id(entry)].pending = True
@@ -3,55 +3,69 @@ import csv
 from datetime import date
 from io import StringIO
 
-import dateparser
-import eml_parser
 from beancount.core import data
 from beancount.core.data import Amount, Balance, Decimal, Transaction
-from bs4 import BeautifulSoup
 
 from . import DictReaderStrip, get_account_by_name
-from .base import Base
-from .deduplicate import Deduplicate
+from .base import Base, Record, XPaths, parse_html
 
 AccountUnknown = 'Assets:Unknown'
+# 与原先的CSS选择器匹配规则相同，注释中为对应的选择器
+xpaths = XPaths(
+    # .title
+    title='//*[contains(concat(" ", normalize-space(@class), " "), " title ")]',
+    # [style="busi-cunkuan1.tab3.display"] .table1 tr
+    balances='//*[@style="busi-cunkuan1.tab3.display"]'
+    '//*[contains(concat(" ", normalize-space(@class), " "), " table1 ")]//tr',
+    # [style="busi-other_detail.tab3.display"] .table1 tr
+    bands='//*[@style="busi-other_detail.tab3.display"]'
+    '//*[contains(concat(" ", normalize-space(@class), " "), " table1 ")]//tr',
+    # row.select('td.dspts')
+    tds='descendant::td[contains(concat(" ", normalize-space(@class), " "), " dspts ")]',
+)
 
 
-class ICBCDebit():
+class ICBCDebit(Base):
 
-    def __init__(self, filename, byte_content, entries, option_map):
-        if not filename.endswith('html') and not filename.endwith('htm'):
-            raise 'Not ICBC!'
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        if not filename.endswith('html') and not filename.endswith('htm'):
+            return False
+        return '中国工商银行'.encode('gbk') in head_bytes
+
+    def __init__(self, filename, byte_content, deduplicate):
+        if not filename.endswith('html') and not filename.endswith('htm'):
+            raise ValueError('Not ICBC!')
         content = str(byte_content.decode('gbk'))
-        self.soup = BeautifulSoup(content, 'html.parser')
-        title = self.soup.select('.title')[0].text
+        self.document = parse_html(content)
+        title = xpaths.title(self.document)[0].text_content()
         if '中国工商银行' not in title:
-            raise 'Not ICBC!'
+            raise ValueError('Not ICBC!')
         self.content = content
-        self.deduplicate = Deduplicate(entries, option_map)
+        self.deduplicate = deduplicate
 
     def change_currency(self, currency):
         if currency == 'RMB':
             return 'CNY'
         return currency
 
-    def parse(self):
-        d = self.soup
-        transactions = []
+    def extract(self):
+        d = self.document
         last_account = ''
-        date_string = d.text.split('出单日：')[1].split('日期范围')[0].strip()
+        date_string = d.text_content().split('出单日：')[1].split('日期范围')[0].strip()
         balance_date = date(int(date_string[0:4]), int(
             date_string[5:7]), int(date_string[8:10]))
-        balances = d.select('[style="busi-cunkuan1.tab3.display"] .table1 tr')
+        balances = xpaths.balances(d)
         for balance in balances:
-            tds = balance.select('td.dspts')
+            tds = xpaths.tds(balance)
             if len(tds) == 0 or len(tds) < 3:
                 continue
-            account = tds[0].text.strip()
+            account = tds[0].text_content().strip()
             account = last_account if account == '' else account
             last_account = account
             balance_account = get_account_by_name('ICBC_' + account)
-            currency = self.change_currency(tds[3].text.strip())
-            price = str(tds[5].text.strip().replace(',', ''))
+            currency = self.change_currency(tds[3].text_content().strip())
+            price = str(tds[5].text_content().strip().replace(',', ''))
             entry = Balance(
                 account=balance_account,
                 amount=Amount(Decimal(price), currency),
@@ -60,23 +74,23 @@ class ICBCDebit():
                 diff_amount=Amount(Decimal('0'), currency),
                 date=balance_date
             )
-            transactions.append(entry)
+            yield Record(entry)
 
-        bands = d.select('[style="busi-other_detail.tab3.display"] .table1 tr')
+        bands = xpaths.bands(d)
 
         for band in bands:
-            tds = band.select('td.dspts')
+            tds = xpaths.tds(band)
             if len(tds) == 0:
                 continue
-            trade_date = tds[10].text.strip()
+            trade_date = tds[10].text_content().strip()
             if trade_date == '':
                 continue
             time = date(int(trade_date[0:4]), int(
                 trade_date[4:6]), int(trade_date[6:8]))
-            description = tds[6].text.strip()
-            trade_currency = self.change_currency(tds[3].text.strip())
-            trade_price = tds[7].text.strip()
-            account = tds[0].text.strip()
+            description = tds[6].text_content().strip()
+            trade_currency = self.change_currency(tds[3].text_content().strip())
+            trade_price = tds[7].text_content().strip()
+            account = tds[0].text_content().strip()
             account = last_account if account == '' else account
             last_account = account
             print("Importing {} at {}".format(description, time))
@@ -103,8 +117,4 @@ class ICBCDebit():
             data.create_simple_posting(
                 entry, trade_account, trade_price, trade_currency)
             data.create_simple_posting(entry, AccountUnknown, None, None)
-            if not self.deduplicate.find_duplicate(entry, -amount, None, account):
-                transactions.append(entry)
-
-        self.deduplicate.apply_beans()
-        return transactions
+            yield Record(entry, -amount, None, account)
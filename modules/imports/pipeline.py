@@ -0,0 +1,213 @@
+import glob
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+from beancount.core import data
+from beancount.parser import printer
+
+from ..profiler import profiler
+from .base import HEAD_SIZE
+
+# 推荐的导入顺序：支付宝、微信、余额宝、银行卡账单
+# (类名, 模块名, 文件名后缀)，识别时才导入模块；后缀不符的导入器不必导入，为None时只按内容识别
+importers = [
+    ('Alipay', 'alipay', None),
+    ('WeChat', 'wechat', None),
+    ('YuEBao', 'yuebao', ('xls',)),
+    ('CITICCredit', 'citic_credit', ('eml',)),
+    ('CMBCCredit', 'cmbc_credit', ('eml',)),
+    ('CMBCredit', 'cmb_credit', ('eml',)),
+    ('ICBCDebit', 'icbc_debit', ('html', 'htm')),
+]
+
+
+def expand_paths(paths):
+    filenames = []
+    for item in paths:
+        if path.isdir(item):
+            matches = [path.join(item, name) for name in sorted(os.listdir(item))
+                       if not name.startswith('.')]
+            matches = [name for name in matches if path.isfile(name)]
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item))
+        else:
+            matches = [item]
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+
+def read_head(filename):
+    with open(filename, 'rb') as f:
+        return f.read(HEAD_SIZE)
+
+
+@profiler.wrap('detect.load')
+def load_importer(index):
+    name, module, suffixes = importers[index]
+    return getattr(importlib.import_module('.' + module, __package__), name)
+
+
+def importer_index(importer):
+    return [item[0] for item in importers].index(importer.__name__)
+
+
+@profiler.wrap('detect')
+def identify(filename, head_bytes):
+    for index, (name, module, suffixes) in enumerate(importers):
+        if suffixes != None and not filename.endswith(suffixes):
+            continue
+        importer = load_importer(index)
+        if importer.identify(filename, head_bytes):
+            return importer
+    return None
+
+
+def create_importer(importer, filename, byte_content, deduplicate):
+    try:
+        # 构造时完成解码、HTML/EML解析等
+        with profiler.stage('read.' + importer.__name__):
+            return importer(filename, byte_content, deduplicate)
+    except Exception as e:
+        print("{} failed to read {}: {}".format(
+            importer.__name__, filename, e))
+        return None
+
+
+def find_importer(filename, byte_content, deduplicate):
+    importer = identify(filename, byte_content[:HEAD_SIZE])
+    if importer == None:
+        return None
+    return create_importer(importer, filename, byte_content, deduplicate)
+
+
+def extract_file(filename):
+    # 在子进程中运行：只做识别和解析，返回可pickle的记录
+    with open(filename, 'rb') as f:
+        byte_content = f.read()
+    instance = find_importer(filename, byte_content, None)
+    if instance == None:
+        return filename, None, []
+    return filename, importer_index(type(instance)), list(instance.extract())
+
+
+def extract_files(filenames, jobs=None):
+    # 子进程内的各阶段不计入，只统计整体耗时
+    with profiler.stage('parse.pool'), ProcessPoolExecutor(jobs) as executor:
+        return list(executor.map(extract_file, filenames))
+
+
+def open_file(filename, importer):
+    # 支持流式读取的导入器构造时只读取头部，解析时才逐行读取，不会一次读入整个文件
+    byte_content = None
+    if not importer.streaming:
+        with open(filename, 'rb') as f:
+            byte_content = f.read()
+    return create_importer(importer, filename, byte_content, None)
+
+
+def import_files(paths, deduplicate, jobs=None):
+    """
+    按推荐顺序返回 [(filename, entries)]。只有一个账单时entries是边解析边去重的生成器，
+    多个账单时已全部去重完毕；消费完后再调用 deduplicate.apply_beans() 写回账本。
+    """
+    filenames = expand_paths(paths)
+    results = []
+    if jobs != 1 and len(filenames) > 1:
+        extracted = []
+        for filename, index, records in extract_files(filenames, jobs):
+            if index == None:
+                print("No suitable importer for " + filename)
+                continue
+            extracted.append((filename, index, records))
+        # 去重、修改账本都在主进程中按固定顺序进行，保证结果与并行度无关
+        extracted.sort(key=lambda item: item[1])
+        for filename, index, records in extracted:
+            entries = load_importer(index).filter(records, deduplicate)
+            results.append((filename, profiler.iterate('dedup', entries)))
+        return dedup_batch(results, deduplicate)
+
+    detected = []
+    for filename in filenames:
+        importer = identify(filename, read_head(filename))
+        if importer == None:
+            print("No suitable importer for " + filename)
+            continue
+        detected.append((filename, importer))
+    detected.sort(key=lambda item: importer_index(item[1]))
+    for filename, importer in detected:
+        # 构造失败的账单与子进程中一样跳过，不输出
+        instance = open_file(filename, importer)
+        if instance == None:
+            continue
+        records = profiler.iterate(
+            'parse.' + importer.__name__, instance.extract())
+        entries = importer.filter(records, deduplicate)
+        results.append((filename, profiler.iterate('dedup', entries)))
+    return dedup_batch(results, deduplicate)
+
+
+def dedup_batch(results, deduplicate):
+    # 后面的账单可能与前面账单新导入的交易是同一笔（如支付宝与银行卡账单），去重时会修改前面的交易，
+    # 多个账单时需要全部去重完再输出
+    if len(results) < 2:
+        return results
+    results = [(filename, list(entries)) for filename, entries in results]
+    return [(filename, [deduplicate.current_entry(entry) for entry in entries])
+            for filename, entries in results]
+
+
+def print_entries(entries, file):
+    # 与 printer.print_entries 输出相同，但逐条写入，不需要先生成整个列表
+    eprinter = printer.EntryPrinter()
+    previous_type = None
+    for entry in entries:
+        entry_type = type(entry)
+        if previous_type == None:
+            previous_type = entry_type
+        if (entry_type in (data.Transaction, data.Commodity) or
+                entry_type is not previous_type):
+            file.write('\n')
+            previous_type = entry_type
+        file.write(eprinter(entry))
+
+
+def unique_path(filename):
+    # 已存在同名文件时依次尝试 name-1.bean、name-2.bean ...
+    base, ext = path.splitext(filename)
+    i = 0
+    while path.exists(filename):
+        i += 1
+        filename = '{}-{}{}'.format(base, i, ext)
+    return filename
+
+
+@profiler.wrap('output')
+def write_entries(results, out=None, out_dir=None, overwrite=True, outputs=None):
+    # outputs在打开文件时就记录，写到一半出错时调用方可据此删除不完整的输出
+    if outputs == None:
+        outputs = []
+    if out_dir != None:
+        os.makedirs(out_dir, exist_ok=True)
+        for filename, new_entries in results:
+            name = path.splitext(path.basename(filename))[0] + '.bean'
+            out_file = path.join(out_dir, name)
+            # 同一次导入中的同名账单（如不同目录下的同名文件、x.csv与x.eml）依次编号，不互相覆盖
+            if not overwrite or out_file in outputs:
+                out_file = unique_path(out_file)
+            outputs.append(out_file)
+            with open(out_file, 'w') as f:
+                print_entries(new_entries, file=f)
+        return outputs
+    with open(out, 'w') as f:
+        for filename, new_entries in results:
+            if len(results) > 1:
+                f.write('; {}\n\n'.format(filename))
+            print_entries(new_entries, file=f)
+            if len(results) > 1:
+                f.write('\n')
+    outputs.append(out)
+    return outputs
@@ -0,0 +1,33 @@
+from datetime import datetime
+from functools import lru_cache
+
+from ..profiler import profiler
+
+# 各导入器账单中出现过的时间格式，按出现频率排列
+ALIPAY_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S',
+                  '%Y/%m/%d %H:%M', '%Y-%m-%d %H:%M')
+WECHAT_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S',
+                  '%Y/%m/%d %H:%M')
+CMB_FORMATS = ('%Y/%m/%d', '%Y-%m-%d', '%Y年%m月%d日')
+
+
+@lru_cache(maxsize=65536)
+def parse_time(text, formats=ALIPAY_FORMATS):
+    text = text.strip()
+    for format in formats:
+        try:
+            return datetime.strptime(text, format)
+        except ValueError:
+            pass
+    # 已知格式都不匹配时才使用dateparser，它导入和解析都很慢
+    with profiler.stage('dateparser'):
+        import dateparser
+        return dateparser.parse(text)
+
+
+def format_trade_time(time):
+    return str(time)
+
+
+def format_timestamp(time):
+    return str(time.timestamp()).replace('.0', '')
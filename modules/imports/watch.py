@@ -0,0 +1,164 @@
+"""
+常驻进程：账本只加载一次，监视收件目录，新账单下载完成后自动识别、去重并导入。
+导入时写回账本只更新去重索引中的行号；账本在别处被修改后才重新加载，且只重新解析改动过的文件。
+"""
+import os
+import time
+import traceback
+from os import path
+
+from beancount.core.data import Transaction
+
+from .. import ledger
+from .deduplicate import Deduplicate
+from .pipeline import import_files, write_entries
+
+# 浏览器下载中的临时文件
+PARTIAL_SUFFIXES = ('.part', '.crdownload', '.download', '.tmp')
+
+
+class Watcher:
+
+    def __init__(self, entry, inboxes, out_dir, interval=2, use_cache=True):
+        self.entry = entry
+        self.inboxes = inboxes
+        self.out_dir = out_dir
+        self.interval = interval
+        self.use_cache = use_cache
+        # 已导入的账单：filename -> (修改时间, 大小)
+        self.seen = {}
+        # 导入失败的账单，文件改动后才重试
+        self.failed = {}
+        # 上次扫描时看到、但还不确定是否下载完的账单
+        self.pending = {}
+        # 本次运行中导入的交易，输出文件尚未include进账本时仍需用于去重
+        self.imported = []
+        self.ledger_stamps = None
+        self.deduplicate = None
+
+    def load(self):
+        start = time.time()
+        entries, errors, option_map = ledger.reload_file(
+            self.entry, self.use_cache)
+        self.ledger_stamps = ledger.file_stamps(option_map['include'])
+        self.deduplicate = Deduplicate(entries, option_map)
+        for entry in self.imported:
+            self.deduplicate.add_entry(entry)
+        print('Loaded {} in {:.2f}s'.format(self.entry, time.time() - start))
+
+    def ledger_files(self):
+        return [stamp[0] for stamp in self.ledger_stamps]
+
+    def ledger_changed(self):
+        if self.ledger_stamps == None:
+            return True
+        return ledger.file_stamps(self.ledger_files()) != self.ledger_stamps
+
+    def list_files(self):
+        for inbox in self.inboxes:
+            if not path.isdir(inbox):
+                continue
+            for name in sorted(os.listdir(inbox)):
+                if name.startswith('.') or name.endswith(PARTIAL_SUFFIXES):
+                    continue
+                filename = path.join(inbox, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                if path.isfile(filename):
+                    yield filename, (stat.st_mtime_ns, stat.st_size)
+
+    def skip_existing(self):
+        for filename, stamp in self.list_files():
+            self.seen[filename] = stamp
+
+    def scan(self):
+        ready = []
+        for filename, stamp in self.list_files():
+            if self.seen.get(filename) == stamp or self.failed.get(filename) == stamp:
+                continue
+            # 两次扫描之间大小和修改时间都没有变化，才认为已经下载完
+            if self.pending.get(filename) != stamp:
+                self.pending[filename] = stamp
+                continue
+            del self.pending[filename]
+            ready.append((filename, stamp))
+        return ready
+
+    def remember(self, entries):
+        for entry in entries:
+            if isinstance(entry, Transaction):
+                self.imported.append(entry)
+            yield entry
+
+    def import_files(self, ready):
+        start = time.time()
+        filenames = [filename for filename, stamp in ready]
+        imported = len(self.imported)
+        outputs = []
+        try:
+            results = import_files(filenames, self.deduplicate, 1)
+            results = [(filename, self.remember(entries))
+                       for filename, entries in results]
+            # 不覆盖之前导入的输出，同名账单依次编号
+            write_entries(results, out_dir=self.out_dir,
+                          overwrite=False, outputs=outputs)
+            # 写回时索引中的行号已随之更新，自己的修改不需要重新加载账本
+            self.deduplicate.apply_beans()
+        except Exception:
+            traceback.print_exc()
+            print('Failed to import ' + ', '.join(filenames))
+            self.discard(outputs, imported)
+            if len(ready) > 1:
+                # 逐个重新导入，只跳过出错的账单
+                for item in ready:
+                    if self.deduplicate == None:
+                        break
+                    self.import_files([item])
+            else:
+                self.failed[filenames[0]] = ready[0][1]
+            return
+        for filename, stamp in ready:
+            self.seen[filename] = stamp
+            self.failed.pop(filename, None)
+        if len(outputs) == 0:
+            return
+        self.ledger_stamps = ledger.file_stamps(self.ledger_files())
+        for out in outputs:
+            print('Outputed to ' + out)
+        print('Imported {} statement(s) in {:.2f}s'.format(
+            len(outputs), time.time() - start))
+
+    def discard(self, outputs, imported):
+        for out in outputs:
+            if path.exists(out):
+                os.remove(out)
+        del self.imported[imported:]
+        # 丢弃未写回的账本修改和本批次加入索引的交易，账本可能已被部分写回，一并重新加载
+        self.deduplicate = None
+        self.ledger_stamps = None
+        try:
+            self.load()
+        except Exception:
+            # 留到下次扫描前重新加载
+            traceback.print_exc()
+
+    def run(self, import_existing=False):
+        self.load()
+        if not import_existing:
+            self.skip_existing()
+        print('Watching ' + ', '.join(self.inboxes))
+        while True:
+            # 账本在别处被修改后行号可能已变化，需要先重新加载
+            if self.ledger_changed():
+                try:
+                    self.load()
+                except Exception:
+                    traceback.print_exc()
+                    time.sleep(self.interval)
+                    continue
+            ready = self.scan()
+            if len(ready) > 0:
+                self.import_files(ready)
+            time.sleep(self.interval)
@@ -1,17 +1,17 @@
 import calendar
 import csv
 from datetime import date
-from io import StringIO
+from itertools import islice
 
-import dateparser
 from beancount.core import data
 from beancount.core.data import Note, Transaction
 
 from ..accounts import accounts
 from . import (DictReaderStrip, get_account_by_guess,
                get_income_account_by_guess, replace_flag)
-from .base import Base
-from .deduplicate import Deduplicate
+from .base import Base, Record
+from .timestamp import (WECHAT_FORMATS, format_timestamp, format_trade_time,
+                        parse_time)
 
 Account零钱通 = 'Assets:Company:WeChat:Lingqiantong'
 Account收入红包 = 'Income:RedBag'
@@ -20,30 +20,38 @@ Account余额 = 'Assets:Balances:WeChat'
 
 
 class WeChat(Base):
+    streaming = True
 
-    def __init__(self, filename, byte_content, entries, option_map):
-        content = byte_content.decode("utf-8-sig")
-        lines = content.split("\n")
-        if (lines[0].replace(',', '') != '微信支付账单明细\r'):
-            raise 'Not WeChat Trade Record!'
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        if head_bytes.startswith(b'\xef\xbb\xbf'):
+            head_bytes = head_bytes[3:]
+        return head_bytes.startswith('微信支付账单明细'.encode('utf-8'))
 
-        print('Import WeChat: ' + lines[2])
-        content = "\n".join(lines[16:len(lines)])
-        self.content = content
-        self.deduplicate = Deduplicate(entries, option_map)
+    def __init__(self, filename, byte_content, deduplicate):
+        self.filename = filename
+        self.byte_content = byte_content
+        lines = self.lines('utf-8-sig')
+        head = list(islice(lines, 3))
+        lines.close()
+        if (head[0].replace(',', '') != '微信支付账单明细\r'):
+            raise ValueError('Not WeChat Trade Record!')
 
-    def parse(self):
-        content = self.content
-        f = StringIO(content)
-        reader = DictReaderStrip(f, delimiter=',')
-        transactions = []
+        print('Import WeChat: ' + head[2])
+        self.deduplicate = deduplicate
+
+    def extract(self):
+        # 跳过16行表头，逐行交给csv
+        lines = islice(self.lines('utf-8-sig'), 16, None)
+        reader = DictReaderStrip(
+            (line + '\n' for line in lines), delimiter=',')
         for row in reader:
             print("Importing {} at {}".format(row['商品'], row['交易时间']))
             meta = {}
-            time = dateparser.parse(row['交易时间'])
+            time = parse_time(row['交易时间'], WECHAT_FORMATS)
             meta['wechat_trade_no'] = row['交易单号']
-            meta['trade_time'] = row['交易时间']
-            meta['timestamp'] = str(time.timestamp()).replace('.0', '')
+            meta['trade_time'] = format_trade_time(time)
+            meta['timestamp'] = format_timestamp(time)
             account = get_account_by_guess(row['交易对方'], row['商品'], time)
             # flag = "*"
             amount_string = row['金额(元)'].replace('¥', '')
@@ -112,8 +120,4 @@ class WeChat(Base):
 
             #b = printer.format_entry(entry)
             # print(b)
-            if not self.deduplicate.find_duplicate(entry, amount, 'wechat_trade_no'):
-                transactions.append(entry)
-
-        self.deduplicate.apply_beans()
-        return transactions
+            yield Record(entry, amount, 'wechat_trade_no')
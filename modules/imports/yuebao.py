@@ -4,44 +4,62 @@ import datetime
 from datetime import date
 from io import StringIO
 
-import xlrd
 from beancount.core import data
 from beancount.core.data import Note, Transaction
 
 from . import (DictReaderStrip, get_account_by_guess,
                get_income_account_by_guess)
-from .base import Base
-from .deduplicate import Deduplicate
+from ..accounts import dedup_windows
+from .base import Base, Record
 
 Account余额宝 = 'Assets:Company:Alipay:MonetaryFund'
 incomes = ['余额自动转入', '收益', '单次转入']
 
 
+def xldates(values, datemode):
+    # 与 xlrd.xldate_as_tuple 相同，精确到秒，一次转换整列
+    epoch = datetime.datetime(1904, 1, 1) if datemode == 1 else datetime.datetime(1899, 12, 30)
+    return [epoch + datetime.timedelta(int(value), int(round((value - int(value)) * 86400.0)))
+            for value in values]
+
+
 class YuEBao(Base):
 
-    def __init__(self, filename, byte_content, entries, option_map):
+    @classmethod
+    def identify(cls, filename, head_bytes):
+        # xls为OLE2复合文档
+        return filename.endswith('xls') and head_bytes.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1')
+
+    def __init__(self, filename, byte_content, deduplicate):
         if not filename.endswith('xls'):
-            raise 'Not YuEBao!'
-        data = xlrd.open_workbook(filename)
-        table = data.sheets()[0]
-        rows_value = table.row_values(0)
-        if rows_value[0] != '余额宝收支明细查询':
-            raise 'Not YuEBao!'
-        self.book = data
+            raise ValueError('Not YuEBao!')
+        # 只有识别为该账单时才导入，加快启动
+        import xlrd
+        # 直接用已读入的内容，只加载第一个工作表
+        book = xlrd.open_workbook(
+            filename, file_contents=byte_content, on_demand=True)
+        table = book.sheet_by_index(0)
+        if table.cell_value(0, 0) != '余额宝收支明细查询':
+            raise ValueError('Not YuEBao!')
+        self.book = book
         self.table = table
-        self.deduplicate = Deduplicate(entries, option_map)
+        self.deduplicate = deduplicate
 
-    def parse(self):
+    def extract(self):
         table = self.table
-        rows = table.nrows
-        for i in range(5, rows - 4):
-            row = table.row_values(i)
-            time = datetime.datetime(
-                *xlrd.xldate_as_tuple(table.cell_value(rowx=i, colx=0), self.book.datemode))
+        start = 5
+        end = table.nrows - 4
+        # 按列一次取出，不再逐行读取
+        times = xldates(table.col_values(0, start, end), self.book.datemode)
+        amounts = table.col_values(1, start, end)
+        types = table.col_values(2, start, end)
+        balances = table.col_values(3, start, end)
+        self.book.release_resources()
+        for time, amount, trade_type, balance in zip(times, amounts, types, balances):
             print("Importing {} price = {} balance = {}".format(
-                time, row[2], row[3]))
+                time, trade_type, balance))
             meta = {}
-            amount = float(row[1])
+            amount = float(amount)
 
             entry = Transaction(
                 meta,
@@ -53,12 +71,18 @@ class YuEBao(Base):
                 data.EMPTY_SET, []
             )
 
-            if not row[2] in incomes:
+            if not trade_type in incomes:
                 amount = -amount
 
-            if self.deduplicate.find_duplicate(entry, amount, None, Account余额宝):
-                print(
-                    "Unknown transaction for {}, check if Alipay transaction exists.".format(time))
+            yield Record(entry, amount, None, Account余额宝)
 
-        self.deduplicate.apply_beans()
-        return []
+    @classmethod
+    def filter(cls, records, deduplicate):
+        # 余额宝账单只用于修正支付宝交易的支付手段，不导入任何交易
+        # 与 Base.filter 一样是生成器，输出到这个账单时才去重，此时前面的支付宝、微信账单已处理完
+        for record in records:
+            if deduplicate.find_duplicate(record.entry, record.money, record.unique_no, record.replace_account,
+                                          window=dedup_windows.get(cls.__name__), source=cls.__name__):
+                print("Unknown transaction for {}, check if Alipay transaction exists.".format(
+                    record.entry.date))
+        yield from ()
@@ -0,0 +1,126 @@
+import os
+import pickle
+from os import path
+
+import beancount
+
+from .profiler import profiler
+
+CACHE_VERSION = 1
+
+
+def cache_path(filename):
+    # 与 beancount 的 .main.bean.picklecache 一样放在账本旁边，不放在所有用户共用的临时目录
+    filename = path.abspath(filename)
+    return path.join(path.dirname(filename), '.{}.ledgercache'.format(path.basename(filename)))
+
+
+def owned_by_user(f):
+    # 反序列化可执行任意代码，只读取当前用户自己写的缓存
+    if not hasattr(os, 'getuid'):
+        return True
+    return os.fstat(f.fileno()).st_uid == os.getuid()
+
+
+def file_stamps(filenames):
+    stamps = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        stamps.append((filename, stat.st_mtime_ns, stat.st_size))
+    return stamps
+
+
+def read_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            if not owned_by_user(f):
+                return None
+            # 先只读头部，文件有变动时不必反序列化整个账本
+            header = pickle.load(f)
+            if header['version'] != (CACHE_VERSION, beancount.__version__):
+                return None
+            if file_stamps([stamp[0] for stamp in header['files']]) != header['files']:
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def write_cache(cache_file, result):
+    entries, errors, option_map = result
+    stamps = file_stamps(option_map['include'])
+    if stamps is None:
+        return
+    header = {
+        'version': (CACHE_VERSION, beancount.__version__),
+        'files': stamps,
+    }
+    temp_file = cache_file + '.{}.tmp'.format(os.getpid())
+    try:
+        with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except (OSError, pickle.PicklingError):
+        if path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def load_file(filename, use_cache=True):
+    """
+    与 beancount.loader.load_file 相同，但会将结果缓存到账本旁边的 .<账本文件名>.ledgercache。
+    缓存以账本及其所有include文件的路径、修改时间和大小为键，任一文件变动即失效。
+    """
+    cache_file = cache_path(filename)
+    if use_cache:
+        result = read_cache(cache_file)
+        if result is not None:
+            profiler.count('ledger.cache_hits')
+            return result
+    # 命中缓存时不需要导入loader及其插件
+    from beancount import loader
+    result = loader.load_file(filename)
+    if use_cache:
+        write_cache(cache_file, result)
+    return result
+
+
+# 常驻进程中各文件的解析结果：{filename: (修改时间与大小, 序列化后的解析结果)}
+parsed_files = {}
+
+
+def cached_parser(parse_file):
+    def parse(filename, *args, **kwargs):
+        stamps = file_stamps([filename])
+        cached = parsed_files.get(filename)
+        if stamps != None and cached != None and cached[0] == stamps[0]:
+            profiler.count('ledger.parse_hits')
+            # 插件可能修改条目的meta，每次都反序列化出新的对象
+            return pickle.loads(cached[1])
+        result = parse_file(filename, *args, **kwargs)
+        if stamps != None:
+            parsed_files[filename] = (stamps[0], pickle.dumps(
+                result, pickle.HIGHEST_PROTOCOL))
+        return result
+    return parse
+
+
+def reload_file(filename, use_cache=True):
+    """
+    供常驻进程重新加载账本：只重新解析改动过的文件，其余文件沿用上次的解析结果，
+    booking、插件和校验仍对整个账本进行。结果同样写入 load_file 的缓存。
+    """
+    from beancount import loader
+    from beancount.parser import parser
+    parse_file = parser.parse_file
+    parser.parse_file = cached_parser(parse_file)
+    try:
+        result = loader.load_file(filename)
+    finally:
+        parser.parse_file = parse_file
+    if use_cache:
+        write_cache(cache_path(filename), result)
+    return result
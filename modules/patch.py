@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from os import path
+
+# 定位行号时先按块数换行符跳过，块内再逐行查找
+CHUNK_SIZE = 64 * 1024
+
+
+def journal_path(filename):
+    # 账本是符号链接时，撤销记录放在实际文件旁边
+    filename = path.realpath(filename)
+    return path.join(path.dirname(filename), '.{}.undo'.format(path.basename(filename)))
+
+
+def find_lines(data, linenos):
+    # 返回 {行号: (起始位置, 结束位置)}，不含换行符；linenos需已排序
+    spans = {}
+    pos = 0
+    line = 1
+    size = len(data)
+    for lineno in linenos:
+        while True:
+            end = min(pos + CHUNK_SIZE, size)
+            count = data.count(b'\n', pos, end)
+            if line + count >= lineno or end == size:
+                break
+            line += count
+            pos = end
+        while line < lineno:
+            newline = data.find(b'\n', pos)
+            if newline == -1:
+                raise IndexError('line {} out of range'.format(lineno))
+            pos = newline + 1
+            line += 1
+        end = data.find(b'\n', pos)
+        spans[lineno] = (pos, size if end == -1 else end)
+    return spans
+
+
+def write_atomic(filename, chunks):
+    # 写到同目录的临时文件再重命名，中途出错不会留下写了一半的账本
+    # 符号链接要写到实际文件，而不是把链接替换成普通文件
+    filename = path.realpath(filename)
+    fd, temp_file = tempfile.mkstemp(
+        prefix='.' + path.basename(filename) + '.', dir=path.dirname(filename))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        shutil.copymode(filename, temp_file)
+        os.replace(temp_file, filename)
+    except BaseException:
+        if path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+class LedgerPatch:
+    """
+    记录对账本文件的逐行修改，最后每个文件一次性写回。
+    同一行的多个操作按调用顺序作用在该行的文本上（追加的内容也算在该行内）。
+    """
+
+    def __init__(self):
+        # filename -> {lineno: [(op, args)]}
+        self.edits = {}
+
+    def add(self, filename, lineno, op, *args):
+        lines = self.edits.setdefault(filename, {})
+        lines.setdefault(lineno, []).append((op, args))
+
+    def replace(self, filename, lineno, old, new, count=-1):
+        self.add(filename, lineno, 'replace', old, new, count)
+
+    def append(self, filename, lineno, text):
+        # 在该行之后插入新行
+        self.add(filename, lineno, 'append', text)
+
+    def set(self, filename, lineno, text):
+        self.add(filename, lineno, 'set', text)
+
+    def __len__(self):
+        return sum(len(lines) for lines in self.edits.values())
+
+    def patch_line(self, text, ops):
+        for op, args in ops:
+            if op == 'replace':
+                text = text.replace(*args)
+            elif op == 'append':
+                text += '\n' + args[0]
+            elif op == 'set':
+                text = args[0]
+        return text
+
+    def apply_file(self, filename, lines, journal=True):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        linenos = sorted(lines)
+        spans = find_lines(data, linenos)
+        chunks = []
+        undo = []
+        inserted = []
+        pos = 0
+        # 之前的修改插入的行数，用于计算新文件中的行号
+        offset = 0
+        for lineno in linenos:
+            start, end = spans[lineno]
+            original = data[start:end].decode('utf-8')
+            text = self.patch_line(original, lines[lineno])
+            chunks.append(data[pos:start])
+            chunks.append(text.encode('utf-8'))
+            pos = end
+            undo.append({
+                'line': lineno + offset,
+                'text': text,
+                'original': original,
+            })
+            offset += text.count('\n')
+            inserted.append((lineno, text.count('\n')))
+        chunks.append(data[pos:])
+        write_atomic(filename, chunks)
+        if journal:
+            with open(journal_path(filename), 'w') as f:
+                json.dump({'file': path.realpath(filename), 'edits': undo},
+                          f, ensure_ascii=False)
+        return inserted
+
+    def apply(self, journal=True):
+        # 返回每个文件在各行之后插入的行数 {filename: [(lineno, count)]}，行号为修改前的行号
+        inserted = {}
+        for filename, lines in self.edits.items():
+            inserted[filename] = self.apply_file(filename, lines, journal)
+        self.edits = {}
+        return inserted
+
+
+def undo(filename):
+    # 撤销最近一次对该文件的修改，文件在此之后被改动过则拒绝撤销
+    with open(journal_path(filename), 'r') as f:
+        journal = json.load(f)
+    with open(filename, 'rb') as f:
+        data = f.read()
+    edits = journal['edits']
+    spans = find_lines(data, [edit['line'] for edit in edits])
+    chunks = []
+    pos = 0
+    for edit in edits:
+        start, _ = spans[edit['line']]
+        text = edit['text'].encode('utf-8')
+        end = start + len(text)
+        if data[start:end] != text or (end < len(data) and data[end:end + 1] != b'\n'):
+            raise ValueError('{} changed after line {} was patched'.format(
+                filename, edit['line']))
+        chunks.append(data[pos:start])
+        chunks.append(edit['original'].encode('utf-8'))
+        pos = end
+    chunks.append(data[pos:])
+    write_atomic(filename, chunks)
+    os.remove(journal_path(filename))
+
+
+if __name__ == '__main__':
+    # python -m modules.patch main.bean 撤销导入时对main.bean的修改
+    for filename in sys.argv[1:]:
+        undo(filename)
+        print('Reverted ' + filename)
@@ -1,13 +1,16 @@
 import json
+import threading
 import time
+from bisect import bisect_left
 from datetime import datetime, timedelta, tzinfo
 from string import Template
 
-import requests
 from beancount.core.number import D
 from beancount.prices import source
 from beancount.utils.date_utils import parse_date_liberally
 
+from .fetch import DEFAULT_TTL, fetch, load_json, save_json
+
 ZERO = timedelta(0)
 BASE_URL_TEMPLATE = Template(
     "http://fund.10jqka.com.cn/$ticker/json/jsondwjz.json")
@@ -33,51 +36,82 @@ class CoinmarketcapError(ValueError):
     "An error from the Coinmarketcap API."
 
 
+# ticker -> {'time': 上次刷新时间, 'dates': ['YYYYMMDD'], 'prices': [str]}，按日期升序
+series_cache = {}
+locks = {}
+
+
+def load_series(ticker):
+    series = series_cache.get(ticker)
+    if series == None:
+        series = load_json('10jqka-{}.json'.format(ticker))
+    if series == None:
+        series = {'time': 0, 'dates': [], 'prices': []}
+    series_cache[ticker] = series
+    return series
+
+
+def refresh_series(ticker, series):
+    # 接口只能返回完整序列，只把比已缓存的最后一天更新的数据追加进去
+    url = BASE_URL_TEMPLATE.substitute(ticker=ticker)
+    content = fetch(url)
+    try:
+        data = json.loads(content.split(b"=")[1])
+    except (IndexError, ValueError):
+        raise CoinmarketcapError(
+            "Invalid response from 10jqka: {}".format(repr(content)))
+    last = series['dates'][-1] if series['dates'] else ''
+    for item in sorted(data, key=lambda item: item[0]):
+        if item[0] > last:
+            series['dates'].append(item[0])
+            series['prices'].append(item[1])
+    series['time'] = time.time()
+    save_json('10jqka-{}.json'.format(ticker), series)
+
+
+def get_navs(ticker):
+    # 返回 {'YYYYMMDD': 净值} ，缓存过期时先刷新，供 fund.py 等按日期查询
+    with locks.setdefault(ticker, threading.Lock()):
+        series = load_series(ticker)
+        if time.time() - series['time'] >= DEFAULT_TTL:
+            refresh_series(ticker, series)
+        return dict(zip(series['dates'], series['prices']))
+
+
 class Source(source.Source):
     def _get_price_for_date(self, ticker, date=None):
 
         if date == None:
-            date_string = "0"
+            date_string = None
         else:
             date_string = date.strftime("%Y%m%d")
 
-        url = BASE_URL_TEMPLATE.substitute(ticker=ticker)
-
-        try:
-            content = requests.get(url).content
-            content = content.split(b"=")[1]
-            data = json.loads(content)
-            price = 0
-            date_int = int(date_string)
-            found_date = False
-
-            if date_string != "0":
-                for item in data:
-                    if item[0] == date_string or int(item[0]) > date_int:
-                        date = item[0]
-                        price = item[1]
-                        found_date = True
-                        break
-
-            if not found_date:
-                item = data[len(data) - 1]
-                price = item[1]
-                date = item[0]
-
-            parsed_date = parse_date_liberally(date)
-            date = datetime(parsed_date.year, parsed_date.month,
-                            parsed_date.day, tzinfo=utc)
-
-            price = D(price)
-
-            return source.SourcePrice(price, date, CURRENCY)
-
-        except KeyError:
-            raise CoinmarketcapError(
-                "Invalid response from 10jqka: {}".format(repr(content)))
-        except AttributeError:
-            raise CoinmarketcapError(
-                "Invalid response from 10jqka: {}".format(repr(content)))
+        with locks.setdefault(ticker, threading.Lock()):
+            series = load_series(ticker)
+            dates = series['dates']
+            # 已缓存范围内的历史日期直接查表，否则在缓存过期后刷新
+            if date_string == None or len(dates) == 0 or date_string > dates[-1]:
+                if time.time() - series['time'] >= DEFAULT_TTL:
+                    refresh_series(ticker, series)
+            if len(dates) == 0:
+                raise CoinmarketcapError(
+                    "No data from 10jqka for {}".format(ticker))
+
+            # 取当天或之后最近的一天，都没有则取最后一天
+            if date_string == None:
+                index = len(dates) - 1
+            else:
+                index = min(bisect_left(dates, date_string), len(dates) - 1)
+            date = dates[index]
+            price = series['prices'][index]
+
+        parsed_date = parse_date_liberally(date)
+        date = datetime(parsed_date.year, parsed_date.month,
+                        parsed_date.day, tzinfo=utc)
+
+        price = D(price)
+
+        return source.SourcePrice(price, date, CURRENCY)
 
     def get_latest_price(self, ticker):
         return self._get_price_for_date(ticker, None)
@@ -0,0 +1,79 @@
+"""
+并发抓取多个商品的价格。各价格源本身是阻塞的，放在线程池中运行，
+由 asyncio 统一调度，并按主机限制并发数和请求间隔。
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+from urllib.parse import urlparse
+
+from beancount.prices import price
+
+
+def source_host(module):
+    # 价格源的请求都发往 BASE_URL_TEMPLATE 所在的主机，取不到时按模块区分
+    template = getattr(module, 'BASE_URL_TEMPLATE', None)
+    if isinstance(template, Template):
+        template = template.template
+    if isinstance(template, str) and urlparse(template).netloc != '':
+        return urlparse(template).netloc
+    return getattr(module, '__name__', str(module))
+
+
+class HostLimiter:
+    # 同一主机同时最多 concurrency 个请求，相邻两次请求至少间隔 interval 秒
+
+    def __init__(self, concurrency, interval):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.interval = interval
+        self.next_time = 0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval > 0:
+            async with self.lock:
+                loop = asyncio.get_running_loop()
+                delay = self.next_time - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.next_time = loop.time() + self.interval
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+async def fetch_job(dprice, limiters, executor):
+    # 与 bean-price 相同，依次尝试各个价格源，第一个成功的为准
+    loop = asyncio.get_running_loop()
+    for psource in dprice.sources:
+        async with limiters[source_host(psource.module)]:
+            try:
+                entry = await loop.run_in_executor(
+                    executor, price.fetch_price, dprice._replace(sources=[psource]))
+            except Exception as e:
+                logging.error("Error fetching %s: %s", psource.symbol, e)
+                continue
+        if entry != None:
+            return entry
+    return None
+
+
+async def fetch_jobs(jobs, workers, per_host, interval):
+    limiters = {}
+    for dprice in jobs:
+        for psource in dprice.sources:
+            host = source_host(psource.module)
+            if host not in limiters:
+                limiters[host] = HostLimiter(per_host, interval)
+    with ThreadPoolExecutor(workers) as executor:
+        return await asyncio.gather(*[fetch_job(dprice, limiters, executor) for dprice in jobs])
+
+
+def fetch_prices(jobs, workers=16, per_host=4, interval=0):
+    """
+    并发执行 bean-price 的 DatedPrice 任务，按任务顺序返回抓取到的 Price，失败的任务被跳过。
+    """
+    entries = asyncio.run(fetch_jobs(jobs, workers, per_host, interval))
+    return [entry for entry in entries if entry != None]
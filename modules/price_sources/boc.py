@@ -1,17 +1,26 @@
+import calendar
+import re
+import threading
 import time
-from datetime import datetime, timedelta, tzinfo
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, tzinfo
 from string import Template
 from urllib.parse import unquote
 
-import requests
 from beancount.core.number import D
 from beancount.prices import source
 from beancount.utils.date_utils import parse_date_liberally
 from bs4 import BeautifulSoup
 
+from .fetch import fetch, load_json, save_json
+
 ZERO = timedelta(0)
 BASE_URL_TEMPLATE = "https://srh.bankofchina.com/search/whpj/search_cn.jsp"
 CURRENCY = "USD"
+LATEST_TTL = 600
+MAX_PAGES = 500
+RECORD_COUNT_RE = re.compile(rb'm_nRecordCount\s*=\s*(\d+)')
+PAGE_SIZE_RE = re.compile(rb'm_nPageSize\s*=\s*(\d+)')
 
 
 class UTCtzinfo(tzinfo):
@@ -32,49 +41,143 @@ class BOCError(ValueError):
     "An error from the BOC."
 
 
-class Source(source.Source):
-    def _get_price_for_date(self, ticker, date=None):
-
-        if date == None:
-            start_time = datetime.today().strftime('%Y-%m-%d')
-            end_time = (datetime.today() + timedelta(days=1)
-                        ).strftime('%Y-%m-%d')
-        else:
-            start_time = date.strftime('%Y-%m-%d')
-            end_time = (date + timedelta(days=1)).strftime('%Y-%m-%d')
-
+def parse_page(content):
+    # 返回本页的行（新发布的在前）和总页数，页数未知时为None
+    soup = BeautifulSoup(content, 'html.parser')
+    main = soup.find('div', {'class': 'BOC_main'})
+    if main == None:
+        raise BOCError("Invalid response from BOC: {}".format(repr(content[:200])))
+    rows = []
+    for tr in main.findChildren('table')[0].findChildren('tr')[1:]:
+        data = [td.text.strip() for td in tr.findChildren('td')]
+        if len(data) >= 7 and data[5] != '':
+            rows.append(data)
+    # 分页信息在页面脚本里
+    pages = None
+    count = RECORD_COUNT_RE.search(content)
+    size = PAGE_SIZE_RE.search(content)
+    if count != None and size != None and int(size.group(1)) > 0:
+        pages = -(-int(count.group(1)) // int(size.group(1)))
+    return rows, pages
+
+
+def fetch_range(ticker, start_time, end_time):
+    # 一次查询整个日期范围，逐页读取所有结果
+    ttl = None
+    if end_time >= datetime.today().strftime('%Y-%m-%d'):
+        ttl = LATEST_TTL
+    rows = []
+    previous = None
+    for page in range(1, MAX_PAGES + 1):
         data = {
             'pjname': unquote(ticker.replace('_', '%')),
             'erectDate': start_time,
             'nothing': end_time,
+            'page': page,
             'head': 'head_620.js',
             'bottom': 'bottom_591.js'
         }
+        page_rows, pages = parse_page(fetch(BASE_URL_TEMPLATE, data, ttl))
+        # 超出最后一页时有的服务会重复返回最后一页
+        if len(page_rows) == 0 or page_rows == previous:
+            break
+        rows += page_rows
+        previous = page_rows
+        if pages != None and page >= pages:
+            break
+    return rows
+
+
+# ticker -> {'rates': {'YYYY-MM-DD': [折算价, 发布时间]}, 'months': [已完整抓取的 'YYYY-MM']}
+tables = {}
+locks = {}
+
+
+def load_table(ticker):
+    table = tables.get(ticker)
+    if table == None:
+        table = load_json('boc-{}.json'.format(ticker))
+    if table == None:
+        table = {'rates': {}, 'months': []}
+    tables[ticker] = table
+    return table
+
+
+def fill_table(table, rows):
+    # 每天保留最后发布的汇率
+    rates = table['rates']
+    for data in rows:
+        day = parse_date_liberally(data[6]).strftime('%Y-%m-%d')
+        if day not in rates or data[6] > rates[day][1]:
+            rates[day] = [str(D(data[5]) / D(100)), data[6]]
+
+
+def fill_months(ticker, table, start_time, end_time):
+    fill_table(table, fetch_range(ticker, start_time, end_time))
+    # 已经过去的月份完整抓取后，之后的查询都不用再请求
+    today = datetime.today().strftime('%Y-%m-%d')
+    month = date(int(start_time[:4]), int(start_time[5:7]), 1)
+    while month.strftime('%Y-%m') <= end_time[:7]:
+        last_day = month.replace(
+            day=calendar.monthrange(month.year, month.month)[1])
+        key = month.strftime('%Y-%m')
+        if (start_time <= month.strftime('%Y-%m-%d') and
+                last_day.strftime('%Y-%m-%d') <= end_time and
+                last_day.strftime('%Y-%m-%d') < today and
+                key not in table['months']):
+            table['months'].append(key)
+        month = last_day + timedelta(days=1)
+    save_json('boc-{}.json'.format(ticker), table)
+
+
+def source_price(day, rate):
+    parsed_date = parse_date_liberally(day)
+    price_time = datetime(parsed_date.year, parsed_date.month,
+                          parsed_date.day, tzinfo=utc)
+    return source.SourcePrice(D(rate), price_time, CURRENCY)
+
+
+class Source(source.Source):
+    def _get_price_for_date(self, ticker, date=None):
 
-        try:
-            content = requests.post(BASE_URL_TEMPLATE, data).content
-            soup = BeautifulSoup(content, 'html.parser')
-            table = soup.find(
-                'div', {'class': 'BOC_main'}).findChildren('table')[0]
-            tr = table.findChildren('tr')[1]
-            data = [td.text.strip() for td in tr.findChildren('td')]
-
-            parsed_date = parse_date_liberally(data[6])
-            date = datetime(parsed_date.year, parsed_date.month,
-                            parsed_date.day, tzinfo=utc)
-
-            price = D(data[5]) / D(100)
-
-            return source.SourcePrice(price, date, CURRENCY)
-
-        except Exception as e:
-            raise e
-        '''except KeyError:
-            raise BOCError(
-                "Invalid response from BOC: {}".format(repr(content)))
-        except AttributeError:
-            raise BOCError(
-                "Invalid response from BOC: {}".format(repr(content)))'''
+        with locks.setdefault(ticker, threading.Lock()):
+            table = load_table(ticker)
+            if date == None:
+                start_time = datetime.today().strftime('%Y-%m-%d')
+                end_time = (datetime.today() + timedelta(days=1)
+                            ).strftime('%Y-%m-%d')
+                rows = fetch_range(ticker, start_time, end_time)
+                if len(rows) == 0:
+                    raise BOCError("No rate from BOC for {}".format(ticker))
+                fill_table(table, rows)
+                save_json('boc-{}.json'.format(ticker), table)
+                return source_price(rows[0][6], D(rows[0][5]) / D(100))
+
+            # 历史汇率按月整月抓取，之后同月的查询直接查表
+            day = date.strftime('%Y-%m-%d')
+            if day[:7] not in table['months']:
+                last_day = calendar.monthrange(date.year, date.month)[1]
+                end_time = min(date.strftime('%Y-%m-') + str(last_day),
+                               datetime.today().strftime('%Y-%m-%d'))
+                fill_months(ticker, table, day[:7] + '-01', end_time)
+
+            # 当天没有发布汇率时，取之前最近一天的
+            days = sorted(table['rates'])
+            index = bisect_right(days, day)
+            if index == 0:
+                raise BOCError("No rate from BOC for {} at {}".format(ticker, day))
+            day = days[index - 1]
+            return source_price(day, table['rates'][day][0])
+
+    def get_prices_series(self, ticker, time_begin, time_end):
+        # 回填一段时间的汇率，整个范围只查询一次
+        start_time = time_begin.strftime('%Y-%m-%d')
+        end_time = time_end.strftime('%Y-%m-%d')
+        with locks.setdefault(ticker, threading.Lock()):
+            table = load_table(ticker)
+            fill_months(ticker, table, start_time, end_time)
+            return [source_price(day, rate[0]) for day, rate in sorted(table['rates'].items())
+                    if start_time <= day <= end_time]
 
     def get_latest_price(self, ticker):
         return self._get_price_for_date(ticker, None)
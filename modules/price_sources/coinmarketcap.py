@@ -1,6 +1,7 @@
-import requests
-import time
+import calendar
 import json
+import threading
+import time
 from datetime import datetime, tzinfo, timedelta
 from string import Template
 
@@ -10,10 +11,14 @@ from beancount.core.number import D
 from beancount.prices import source
 from beancount.utils.date_utils import parse_date_liberally
 
+from .fetch import DEFAULT_TTL, fetch, load_json, save_json
+
 ZERO = timedelta(0)
 BASE_URL_TEMPLATE = Template(
     "https://web-api.coinmarketcap.com/v1/cryptocurrency/ohlcv/historical?convert=$currency&slug=$ticker&time_end=$date_end&time_start=$date_start")
 CURRENCY = "USD"
+WINDOW_DAYS = 90
+DAY_SECONDS = 24 * 60 * 60
 
 
 class UTCtzinfo(tzinfo):
@@ -34,34 +39,82 @@ class CoinmarketcapError(ValueError):
     "An error from the Coinmarketcap API."
 
 
+# slug -> {兑换币种: {'YYYY-MM-DD': 收盘价}}
+closes_cache = {}
+# slug -> 本次运行中查询过的兑换币种，抓取时一并请求
+converts_seen = {}
+locks = {}
+
+
+def load_closes(slug):
+    closes = closes_cache.get(slug)
+    if closes == None:
+        closes = load_json('coinmarketcap-{}.json'.format(slug))
+    if closes == None:
+        closes = {}
+    closes_cache[slug] = closes
+    return closes
+
+
+def fetch_window(slug, converts, day):
+    # 按固定的 WINDOW_DAYS 天划分窗口，同一窗口内的日期共用一次请求
+    index = calendar.timegm(day.timetuple()) // DAY_SECONDS // WINDOW_DAYS
+    start = index * WINDOW_DAYS * DAY_SECONDS
+    end = start + WINDOW_DAYS * DAY_SECONDS
+    ttl = None
+    if end > time.time():
+        ttl = DEFAULT_TTL
+    url = BASE_URL_TEMPLATE.substitute(
+        date_start=start,
+        date_end=end,
+        ticker=slug,
+        currency=','.join(converts))
+    content = fetch(url, ttl=ttl)
+    try:
+        return json.loads(content)['data']['quotes']
+    except (KeyError, TypeError, ValueError):
+        raise CoinmarketcapError(
+            "Invalid response from Coinmarketcap: {}".format(repr(content)))
+
+
+def fill_closes(closes, quotes):
+    # 只保存已经收盘的日期
+    now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+    for quote in quotes:
+        if quote['time_close'] > now:
+            continue
+        day = quote['time_open'][:10]
+        for currency, value in quote['quote'].items():
+            closes.setdefault(currency, {})[day] = str(value['close'])
+
+
 class Source(source.Source):
     def _get_price_for_date(self, ticker, date=None):
         paramater = ticker.split("--")
+        slug = paramater[0]
         currency = paramater[1].upper()
 
         if date == None:
             date = datetime.today().replace(hour=0, minute=0, second=0) + timedelta(days=-1)
-        end_date = date + timedelta(days=1)
-
-        url = BASE_URL_TEMPLATE.substitute(
-            date_start=int(date.timestamp()),
-            date_end=int(end_date.timestamp()),
-            ticker=paramater[0],
-            currency=currency)
-
-        try:
-            content = requests.get(url).content
-            ret = json.loads(content)
-            quote = ret['data']['quotes'][0]['quote'][currency]
-            price = D(quote['close'])
-            return source.SourcePrice(price, date, CURRENCY)
-
-        except KeyError:
-            raise CoinmarketcapError(
-                "Invalid response from Coinmarketcap: {}".format(repr(content)))
-        except AttributeError:
-            raise CoinmarketcapError(
-                "Invalid response from Coinmarketcap: {}".format(repr(content)))
+        day = date.strftime('%Y-%m-%d')
+
+        with locks.setdefault(slug, threading.Lock()):
+            closes = load_closes(slug)
+            seen = converts_seen.setdefault(slug, set())
+            seen.add(currency)
+            if day not in closes.get(currency, {}):
+                # 同一币种的其他兑换币种一起请求，之后查询它们时不必再请求
+                converts = sorted(seen | set(closes))
+                fill_closes(closes, fetch_window(slug, converts, date))
+                save_json('coinmarketcap-{}.json'.format(slug), closes)
+            if day not in closes.get(currency, {}):
+                raise CoinmarketcapError(
+                    "No {} close price from Coinmarketcap for {} at {}".format(currency, slug, day))
+            price = D(closes[currency][day])
+
+        # bean-price 要求返回带时区的时间
+        date = datetime(date.year, date.month, date.day, tzinfo=utc)
+        return source.SourcePrice(price, date, CURRENCY)
 
     def get_latest_price(self, ticker):
         return self._get_price_for_date(ticker, None)
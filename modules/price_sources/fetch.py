@@ -0,0 +1,139 @@
+"""
+价格抓取共用的HTTP层：每个线程复用一个带连接池的Session，
+响应按请求缓存在磁盘上，过期后用ETag/Last-Modified做条件请求。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from os import path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TIMEOUT = 30
+POOL_SIZE = 16
+# 默认放在当前用户的缓存目录下，设置环境变量 PRICE_CACHE_DIR= (空) 可关闭磁盘缓存
+CACHE_DIR = os.environ.get('PRICE_CACHE_DIR', path.join(
+    os.environ.get('XDG_CACHE_HOME') or path.expanduser(path.join('~', '.cache')), 'price-cache'))
+# 默认缓存时间（秒），None表示永不过期
+DEFAULT_TTL = 3600
+
+local = threading.local()
+
+
+def get_session():
+    # bean-price 会在多个线程中抓取，Session不保证线程安全，每个线程一个
+    session = getattr(local, 'session', None)
+    if session == None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        local.session = session
+    return session
+
+
+def cache_key(method, url, data):
+    key = json.dumps([method, url, sorted((data or {}).items())],
+                     ensure_ascii=False)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def cache_path(key):
+    return path.join(CACHE_DIR, key + '.cache')
+
+
+def owned_by_user(f):
+    # 不使用其他用户可能写入的缓存
+    if not hasattr(os, 'getuid'):
+        return True
+    return os.fstat(f.fileno()).st_uid == os.getuid()
+
+
+def read_cache(key):
+    # 第一行为JSON格式的时间和响应头，其后为原始的响应内容
+    try:
+        with open(cache_path(key), 'rb') as f:
+            if not owned_by_user(f):
+                return None
+            cached = json.loads(f.readline().decode('utf-8'))
+            cached['content'] = f.read()
+            return cached
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def write_atomic(filename, content):
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        temp_file = filename + '.{}.{}.tmp'.format(
+            os.getpid(), threading.get_ident())
+        with open(temp_file, 'wb') as f:
+            f.write(content)
+        os.replace(temp_file, filename)
+    except OSError:
+        pass
+
+
+def write_cache(key, cached):
+    header = {name: value for name, value in cached.items() if name != 'content'}
+    write_atomic(cache_path(key), json.dumps(header).encode(
+        'utf-8') + b'\n' + cached['content'])
+
+
+def load_json(name):
+    # 各价格源整理好的数据（如净值序列）也存放在缓存目录下
+    if not CACHE_DIR:
+        return None
+    try:
+        with open(path.join(CACHE_DIR, name), 'r') as f:
+            if not owned_by_user(f):
+                return None
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(name, value):
+    if CACHE_DIR:
+        write_atomic(path.join(CACHE_DIR, name), json.dumps(
+            value, ensure_ascii=False).encode('utf-8'))
+
+
+def fetch(url, data=None, ttl=DEFAULT_TTL):
+    """
+    返回响应内容(bytes)。有data时为POST表单请求。
+    缓存未过期时直接返回；过期后带上ETag/Last-Modified重新请求，304时沿用缓存。
+    ttl为0时每次都会请求（仍可能得到304）。
+    """
+    method = 'POST' if data != None else 'GET'
+    key = cache_key(method, url, data)
+    cached = read_cache(key) if CACHE_DIR else None
+    now = time.time()
+    if cached != None and (ttl == None or now - cached['time'] < ttl):
+        return cached['content']
+
+    headers = {}
+    if cached != None:
+        if cached['etag'] != None:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified'] != None:
+            headers['If-Modified-Since'] = cached['last_modified']
+    response = get_session().request(
+        method, url, data=data, headers=headers, timeout=TIMEOUT)
+
+    if response.status_code == 304 and cached != None:
+        cached['time'] = now
+        write_cache(key, cached)
+        return cached['content']
+    # 只缓存成功的响应，出错时的内容仍原样返回给调用方处理
+    if response.status_code == 200 and CACHE_DIR:
+        write_cache(key, {
+            'time': now,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content': response.content,
+        })
+    return response.content
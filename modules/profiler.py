@@ -0,0 +1,171 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # Windows下没有resource模块
+    resource = None
+
+# Python 3.9 才有 tracemalloc.reset_peak
+reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def traced_peak():
+    # 不能重置峰值时，改为在各阶段进出时采样当前占用，得到的是峰值的近似值
+    current, peak = tracemalloc.get_traced_memory()
+    if reset_peak == None:
+        return current
+    return peak
+
+
+class Stage:
+    __slots__ = ('calls', 'total', 'children', 'peak')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        # 嵌套在本阶段内的其他阶段耗时，用于计算自身耗时
+        self.children = 0.0
+        self.peak = 0
+
+
+class Profiler:
+    """
+    记录各阶段的耗时、调用次数和内存峰值，以及去重等计数器。
+    未启用时 stage/wrap/iterate 几乎没有额外开销。
+    阶段可以嵌套，self 为扣除内部阶段后的耗时；内存峰值为阶段执行期间 Python 堆占用的最高值。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+        # [(stage, start, child_time, peak)]
+        self.stack = []
+
+    def enable(self):
+        self.enabled = True
+        tracemalloc.start()
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def enter(self, name):
+        peak = traced_peak()
+        if self.stack:
+            frame = self.stack[-1]
+            frame[3] = max(frame[3], peak)
+        if reset_peak != None:
+            reset_peak()
+        self.stack.append([name, time.perf_counter(), 0.0, peak])
+
+    def exit(self):
+        end = time.perf_counter()
+        peak = traced_peak()
+        name, start, children, frame_peak = self.stack.pop()
+        elapsed = end - start
+        stage = self.stages.get(name)
+        if stage == None:
+            stage = self.stages[name] = Stage()
+        stage.calls += 1
+        stage.total += elapsed
+        stage.children += children
+        peak = max(peak, frame_peak)
+        stage.peak = max(stage.peak, peak)
+        if self.stack:
+            parent = self.stack[-1]
+            parent[2] += elapsed
+            parent[3] = max(parent[3], peak)
+        if reset_peak != None:
+            reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def wrap(self, name):
+        # 装饰器：每次调用计入一次该阶段
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                self.enter(name)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.exit()
+            return wrapper
+        return decorator
+
+    def iterate(self, name, iterable):
+        # 生成器逐条产出时，把每次取下一条的耗时计入该阶段
+        if not self.enabled:
+            return iterable
+        return self.iterate_stage(name, iter(iterable))
+
+    def iterate_stage(self, name, iterator):
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def report(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {
+                'calls': stage.calls,
+                'total': stage.total,
+                'self': stage.total - stage.children,
+                'peak_memory': stage.peak,
+            }
+        max_rss = None
+        if resource != None:
+            # Linux下ru_maxrss单位为KB，macOS下为字节
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform != 'darwin':
+                max_rss *= 1024
+        return {
+            'stages': stages,
+            'counters': dict(self.counters),
+            'max_rss': max_rss,
+        }
+
+    def print_summary(self, file=sys.stdout):
+        report = self.report()
+        print('{:<24}{:>10}{:>12}{:>12}{:>12}'.format(
+            'stage', 'calls', 'total(s)', 'self(s)', 'peak(MB)'), file=file)
+        for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['self']):
+            print('{:<24}{:>10}{:>12.3f}{:>12.3f}{:>12.1f}'.format(
+                name, stage['calls'], stage['total'], stage['self'],
+                stage['peak_memory'] / 1024 / 1024), file=file)
+        for name, value in sorted(report['counters'].items()):
+            print('{:<24}{:>10}'.format(name, value), file=file)
+        if report['max_rss'] != None:
+            print('max rss: {:.1f} MB'.format(report['max_rss'] / 1024 / 1024), file=file)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+
+# 全局实例，import.py 加上 --profile 时启用
+profiler = Profiler()
@@ -0,0 +1,249 @@
+"""
+生成用于性能测试的合成账本和各类账单，格式与各导入器读取的真实账单一致。
+"""
+import random
+from datetime import date, datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+START_DATE = date(2019, 1, 1)
+Account支付宝 = 'Assets:Company:Alipay:StupidAlipay'
+PAYEES = ['上海拉扎斯信息科技有限公司', '美团', '滴滴出行', '全家便利店', '上海地铁']
+NARRATIONS = ['外卖订单', '美团订单', '地铁出行', '火车票', '便利店购物', '其他']
+AMOUNTS = ['7.80', '12.50', '23.00', '30.00', '45.60', '100.00']
+
+
+def random_time(rng, days):
+    return datetime.combine(START_DATE, datetime.min.time()) + timedelta(
+        days=rng.randrange(days), seconds=rng.randrange(86400))
+
+
+def generate_ledger(filename, postings, days=365, seed=0):
+    # 每笔交易两个posting；约三分之一使用StupidAlipay，便于去重命中
+    rng = random.Random(seed)
+    lines = [
+        'option "operating_currency" "CNY"',
+        '',
+        '2010-01-01 open Assets:Company:Alipay:StupidAlipay',
+        '2010-01-01 open Assets:Company:Alipay:MonetaryFund',
+        '2010-01-01 open Assets:Balances:WeChat',
+        '2010-01-01 open Liabilities:CreditCard:CMB',
+        '2010-01-01 open Liabilities:CreditCard:CITIC',
+        '2010-01-01 open Liabilities:CreditCard:CMBC',
+        '2010-01-01 open Expenses:Food',
+        '',
+    ]
+    transactions = []
+    for i in range(postings // 2):
+        transactions.append((random_time(rng, days), i))
+    transactions.sort()
+    for time, i in transactions:
+        account = Account支付宝 if i % 3 == 0 else 'Liabilities:CreditCard:CMB'
+        lines.append('{} * "{}" "{}"'.format(
+            time.date(), rng.choice(PAYEES), rng.choice(NARRATIONS)))
+        if i % 2 == 0:
+            lines.append('  timestamp: "{}"'.format(int(time.timestamp())))
+        lines.append('  Expenses:Food  {} CNY'.format(rng.choice(AMOUNTS)))
+        lines.append('  ' + account)
+        lines.append('')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def generate_alipay(filename, rows, days=365, seed=1):
+    rng = random.Random(seed)
+    lines = [
+        '支付宝交易记录明细查询',
+        '账号:[bench@example.com]',
+        '起始日期:[2019-01-01 00:00:00]    终止日期:[2020-01-01 00:00:00]',
+        '---------------------------------交易记录明细列表------------------------------------',
+        '交易号,商家订单号,交易创建时间,付款时间,最近修改时间,交易来源地,类型,交易对方,商品名称,金额（元）,收/支,交易状态,服务费（元）,成功退款（元）,备注,资金状态',
+    ]
+    for i in range(rows):
+        time = random_time(rng, days).strftime('%Y-%m-%d %H:%M:%S')
+        lines.append(','.join([
+            '2019{:016d}'.format(i), 'T{:012d}'.format(i), time, time, time,
+            '其他（包括阿里巴巴和外部商家）', '即时到账交易', rng.choice(PAYEES),
+            rng.choice(NARRATIONS), rng.choice(AMOUNTS), '支出', '交易成功',
+            '0.00', '0.00', '', '已支出'
+        ]))
+    lines += [
+        '------------------------------------------------------------------------------------',
+        '共{}笔记录'.format(rows),
+        '已收入:0笔,0.00元',
+        '待收入:0笔,0.00元',
+        '已支出:{}笔,0.00元'.format(rows),
+        '待支出:0笔,0.00元',
+        '导出时间:[2020-01-01 00:00:00]    用户:bench',
+        '',
+    ]
+    with open(filename, 'wb') as f:
+        f.write('\r\n'.join(lines).encode('gbk'))
+
+
+def generate_wechat(filename, rows, days=365, seed=2):
+    rng = random.Random(seed)
+    lines = [
+        '微信支付账单明细,,,,,,,,',
+        '微信昵称：[bench],,,,,,,,',
+        '起始时间：[2019-01-01 00:00:00] 终止时间：[2019-12-31 23:59:59],,,,,,,,',
+        '导出类型：[全部],,,,,,,,',
+        '导出时间：[2020-01-01 00:00:00],,,,,,,,',
+        ',,,,,,,,',
+        '共{}笔记录,,,,,,,,'.format(rows),
+        '收入：0笔 0.00元,,,,,,,,',
+        '支出：{}笔 0.00元,,,,,,,,'.format(rows),
+        '中性交易：0笔 0.00元,,,,,,,,',
+        '注：,,,,,,,,',
+        '1. 充值/提现/理财通购买/零钱通存取/信用卡还款等交易，将计入中性交易,,,,,,,,',
+        '2. 本明细仅展示当前账单中的交易，不包括已删除的记录,,,,,,,,',
+        '3. 本明细仅供个人对账使用,,,,,,,,',
+        ',,,,,,,,',
+        '----------------------微信支付账单明细列表--------------------,,,,,,,,',
+        '交易时间,交易类型,交易对方,商品,收/支,金额(元),支付方式,当前状态,交易单号,商户单号,备注',
+    ]
+    for i in range(rows):
+        time = random_time(rng, days).strftime('%Y-%m-%d %H:%M:%S')
+        lines.append(','.join([
+            time, '商户消费', rng.choice(PAYEES), rng.choice(NARRATIONS), '支出',
+            '¥' + rng.choice(AMOUNTS), '零钱', '支付成功',
+            '4200{:024d}\t'.format(i), '{:020d}\t'.format(i), '/'
+        ]))
+    with open(filename, 'wb') as f:
+        f.write(('\r\n'.join(lines) + '\r\n').encode('utf-8-sig'))
+
+
+def statement_email(filename, subject, html):
+    message = MIMEMultipart('alternative')
+    message['Subject'] = subject
+    message['From'] = 'bank@example.com'
+    message['To'] = 'bench@example.com'
+    message.attach(MIMEText('请使用支持HTML的邮件客户端查看账单。', 'plain', 'utf-8'))
+    message.attach(MIMEText(html, 'html', 'utf-8'))
+    with open(filename, 'wb') as f:
+        f.write(message.as_bytes())
+
+
+def generate_cmb(filename, rows, seed=3):
+    rng = random.Random(seed)
+    bands = []
+    for i in range(rows):
+        day = START_DATE + timedelta(days=rng.randrange(28))
+        price = rng.choice(AMOUNTS)
+        tds = ['', day.strftime('%m%d'), day.strftime('%m%d'),
+               '{}-{}'.format(rng.choice(PAYEES), rng.choice(NARRATIONS)),
+               '￥' + price, '', 'CN', price]
+        bands.append(
+            '<tr><td><div id="fixBand15"><table><tr><td><table><tr>{}</tr></table></td></tr></table></div></td></tr>'.format(
+                ''.join('<td>{}</td>'.format(td) for td in tds)))
+    html = '''<html><body>
+<div id="fixBand38"><div><font>2019/01/01-2019/01/28(账单日)</font></div></div>
+<div id="fixBand40"><div><font>￥1,234.56</font></div></div>
+<div id="fixBand29"><div id="loopBand2"><table><tbody>{}</tbody></table></div></div>
+</body></html>'''.format(''.join(bands))
+    statement_email(filename, '招商银行信用卡电子账单', html)
+
+
+def generate_citic(filename, rows, seed=4):
+    rng = random.Random(seed)
+    bands = []
+    for i in range(rows):
+        day = START_DATE + timedelta(days=rng.randrange(28))
+        price = rng.choice(AMOUNTS)
+        tds = ['', day.strftime('%Y%m%d'), day.strftime('%Y%m%d'), '1234',
+               '{}-{}'.format(rng.choice(PAYEES), rng.choice(NARRATIONS)),
+               'RMB', price, 'RMB', price]
+        bands.append(
+            '<div id="fixBand7"><table><tbody><tr><td><table><tbody><tr>{}</tr></tbody></table></td></tr></tbody></table></div>'.format(
+                ''.join('<td>{}</td>'.format(td) for td in tds)))
+    html = '''<html><body>
+<div id="fixBand16">RMB 1,234.56</div>
+{}
+</body></html>'''.format(''.join(bands))
+    statement_email(filename, '中信银行信用卡电子对账单', html)
+
+
+def generate_cmbc(filename, rows, seed=5):
+    rng = random.Random(seed)
+    bands = []
+    for i in range(rows):
+        day = START_DATE + timedelta(days=rng.randrange(28))
+        tds = ['', day.strftime('%m/%d'), day.strftime('%m/%d'),
+               '{}-{}'.format(rng.choice(PAYEES), rng.choice(NARRATIONS)),
+               rng.choice(AMOUNTS)]
+        bands.append(
+            '<tr><td><table><tbody><tr><td><div id="fixBand9"><table><tbody><tr><td><table><tbody><tr>{}</tr></tbody></table></td></tr></tbody></table></div></td></tr></tbody></table></td></tr>'.format(
+                ''.join('<td>{}</td>'.format(td) for td in tds)))
+    title = '<tr><td><div id="fixBand29"><table><tr><td><table><tr><td>币种</td><td>人民币\xa0RMB</td></tr></table></td></tr></table></div></td></tr>'
+    contents = '<tr><td><div id="loopBand3"><table><tbody>{}</tbody></table></div></td></tr>'.format(
+        ''.join(bands))
+    html = '''<html><body>
+<div id="loopBand2"><table><tbody>{}<tr><td></td></tr><tr><td></td></tr>{}</tbody></table></div>
+</body></html>'''.format(title, contents)
+    statement_email(filename, '民生信用卡2019年01月电子对账单', html)
+
+
+def generate_icbc(filename, rows, seed=6):
+    rng = random.Random(seed)
+
+    def row(tds):
+        return '<tr>{}</tr>'.format(''.join('<td class="dspts">{}</td>'.format(td) for td in tds))
+    balances = [row(['6222000000000000', '活期', '', 'RMB', '', '12,345.67'])]
+    details = []
+    for i in range(rows):
+        day = START_DATE + timedelta(days=rng.randrange(28))
+        details.append(row([
+            '6222000000000000', '', '', 'RMB', '', '',
+            rng.choice(NARRATIONS), '-' + rng.choice(AMOUNTS), '', '',
+            day.strftime('%Y%m%d')]))
+    html = '''<html><head><meta charset="gbk"></head><body>
+<div class="title">中国工商银行 对账单</div>
+<div>出单日：2019-01-31 日期范围：2019-01-01 至 2019-01-31</div>
+<div style="busi-cunkuan1.tab3.display"><table class="table1">{}</table></div>
+<div style="busi-other_detail.tab3.display"><table class="table1">{}</table></div>
+</body></html>'''.format(''.join(balances), ''.join(details))
+    with open(filename, 'wb') as f:
+        f.write(html.encode('gbk'))
+
+
+def generate_yuebao(filename, rows, days=365, seed=7):
+    # 需要xlwt才能生成xls，未安装时返回False
+    try:
+        import xlwt
+    except ImportError:
+        return False
+    rng = random.Random(seed)
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('Sheet1')
+    date_style = xlwt.easyxf(num_format_str='yyyy-mm-dd hh:mm:ss')
+    sheet.write(0, 0, '余额宝收支明细查询')
+    sheet.write(1, 0, '账号：bench@example.com')
+    sheet.write(4, 0, '时间')
+    sheet.write(4, 1, '金额')
+    sheet.write(4, 2, '类型')
+    sheet.write(4, 3, '余额')
+    for i in range(rows):
+        sheet.write(5 + i, 0, random_time(rng, days), date_style)
+        sheet.write(5 + i, 1, float(rng.choice(AMOUNTS)))
+        sheet.write(5 + i, 2, rng.choice(['收益', '消费', '单次转入', '转出到余额']))
+        sheet.write(5 + i, 3, 1000.0)
+    # 与实际导出的账单一样以4行说明结尾，空字符串的单元格不会被保存
+    footer = ['#-----------------------------------------', '#数据统计：',
+              '#导出时间：2020-01-01 00:00:00', '#用户：bench@example.com']
+    for i, text in enumerate(footer):
+        sheet.write(5 + rows + i, 0, text)
+    book.save(filename)
+    return True
+
+
+# 文件名 -> 生成函数，文件名需能被对应导入器识别
+STATEMENTS = {
+    'alipay_record.csv': generate_alipay,
+    '微信支付账单.csv': generate_wechat,
+    '余额宝收支明细.xls': generate_yuebao,
+    '中信银行信用卡.eml': generate_citic,
+    '民生信用卡.eml': generate_cmbc,
+    '招商银行信用卡.eml': generate_cmb,
+    '工商银行对账单.html': generate_icbc,
+}
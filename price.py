@@ -0,0 +1,76 @@
+import argparse
+from datetime import date, timedelta
+
+from beancount.parser import printer
+from beancount.prices import price
+
+from modules import ledger
+from modules.price_sources.batch import fetch_prices
+
+
+def parse_dates(values):
+    # 支持 2019-04-01 和 2019-04-01..2019-04-30 两种写法
+    dates = []
+    for value in values:
+        if '..' in value:
+            start, end = [date.fromisoformat(item) for item in value.split('..')]
+        else:
+            start = end = date.fromisoformat(value)
+        while start <= end:
+            if start not in dates:
+                dates.append(start)
+            start += timedelta(days=1)
+    return sorted(dates)
+
+
+def main():
+    parser = argparse.ArgumentParser("price")
+    parser.add_argument(
+        "--entry", help="Entry bean path (default = main.bean)", default='main.bean')
+    parser.add_argument("--date", action='append', default=[],
+                        help="Date or range like 2019-04-01..2019-04-30, repeatable (default = latest)")
+    parser.add_argument("--out", help="Output bean path", default='prices.bean')
+    parser.add_argument("--workers", type=int, default=16,
+                        help="Fetching threads (default = 16)")
+    parser.add_argument("--per-host", type=int, default=4,
+                        help="Concurrent requests to the same host (default = 4)")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="Minimum seconds between requests to the same host")
+    parser.add_argument("--no-cache", help="Do not use the ledger load cache",
+                        action='store_true')
+    args = parser.parse_args()
+
+    entries, errors, option_map = ledger.load_file(
+        args.entry, not args.no_cache)
+
+    # 所有带 price 元数据的 commodity，不论当前是否持有
+    jobs = []
+    for day in parse_dates(args.date) or [None]:
+        jobs += price.get_price_jobs_at_date(entries, day, inactive=True)
+    if len(jobs) == 0:
+        print("No commodity with price metadata!")
+        exit(1)
+
+    fetched = fetch_prices(jobs, args.workers, args.per_host, args.interval)
+    # 价格源在非交易日返回前后最近一天的价格，按日期范围抓取时不同日期的任务可能得到同一条价格
+    new_entries = []
+    found = set()
+    for entry in fetched:
+        key = (entry.date, entry.currency, entry.amount)
+        if key not in found:
+            found.add(key)
+            new_entries.append(entry)
+    new_entries, ignored_entries = price.filter_redundant_prices(
+        new_entries, entries)
+    new_entries.sort(key=lambda entry: (entry.date, entry.currency))
+
+    with open(args.out, 'w') as f:
+        printer.print_entries(new_entries, file=f)
+    print('Fetched {} of {} prices, {} duplicated, {} already in ledger'.format(
+        len(fetched), len(jobs), len(fetched) - len(found), len(ignored_entries)))
+    print('Outputed to ' + args.out)
+    exit(0)
+
+
+if __name__ == '__main__':
+    main()